@@ -7,6 +7,7 @@ from .brain import Brain
 from .model import Model
 from .nifti import Nifti
 from .location import Location
+from .accumulator import CorrelationAccumulator
 from .load import load
 from .simulate import *
 from .helpers import tal2mni
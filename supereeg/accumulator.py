@@ -0,0 +1,177 @@
+from __future__ import division
+from __future__ import print_function
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from .helpers import _r2z, _z2r
+
+
+class CorrelationAccumulator(object):
+    """
+    Online (streaming) correlation accumulator for the supereeg package
+
+    A correlation accumulator computes a subject's correlation matrix from chunks of samples, so that the full
+    recording never needs to be held in memory (e.g. for multi-day recordings that are streamed from disk, or for
+    data that arrive over time).  For each session, running means and sums of cross products of the deviations from
+    the running means are updated using Welford-style (pairwise) updates.  As with brain objects, the correlation
+    matrix is the average of the sessions' Fisher z-transformed correlation matrices, weighted by recording time.
+    Models can be created directly from accumulators (e.g. se.Model(acc)).
+
+    Parameters
+    ----------
+
+    locs : numpy.ndarray or pandas.DataFrame
+        Electrode by MNI coordinate (x,y,z) array containing electrode locations
+
+    sample_rate : float, int, dict or None
+        Sample rate (Hz) of the data.  If a dict, maps session identifiers to the sample rate of each session.  If
+        None (default), sample rates must be passed to update (or else sessions are weighted by their number of
+        samples).
+
+    meta : dict
+        Optional dict containing whatever you want.
+
+    Attributes
+    ----------
+
+    locs : pandas.DataFrame
+        Electrode by MNI coordinate (x,y,z) df containing electrode locations.
+
+    n_elecs : int
+        Number of electrodes
+
+    n_samples : dict
+        Number of samples accumulated for each session
+
+    Returns
+    ----------
+
+    acc : supereeg.CorrelationAccumulator
+        Instance of a correlation accumulator.
+
+    """
+
+    def __init__(self, locs, sample_rate=None, meta=None):
+        if isinstance(locs, pd.DataFrame):
+            self.locs = locs[['x', 'y', 'z']].reset_index(drop=True)
+        else:
+            self.locs = pd.DataFrame(np.atleast_2d(locs), columns=['x', 'y', 'z'])
+        self.n_elecs = self.locs.shape[0]
+
+        if isinstance(sample_rate, dict):
+            self.sample_rate, self.default_sample_rate = dict(sample_rate), None
+        else:
+            self.sample_rate, self.default_sample_rate = {}, sample_rate
+
+        if meta:
+            self.meta = meta
+        else:
+            self.meta = {}
+        self.date_created = time.strftime("%c")
+
+        self.n_samples = OrderedDict()
+        self._means = {}
+        self._cross_products = {}
+
+    def update(self, data, session=1, sample_rate=None):
+        """
+        Add a chunk of samples to the accumulator
+
+        Parameters
+        ----------
+        data : numpy.ndarray, pandas.DataFrame or supereeg.Brain
+            Samples x electrodes chunk of data.  If a brain object is given, its (filtered) locations must match the
+            accumulator's locations, and its sessions and sample rates are used (session and sample_rate are ignored).
+
+        session : str or int
+            Session identifier of the chunk (default: 1)
+
+        sample_rate : float, int or None
+            Sample rate of the session (only needs to be given once per session)
+        """
+        from .brain import Brain
+
+        if isinstance(data, Brain):
+            assert np.allclose(data.get_locs().as_matrix(), self.locs.as_matrix()), \
+                'brain object locations must match the accumulator locations'
+            groups = data.groupby('session')
+            for (s, x), sr in zip(groups, groups.sample_rates()):
+                self.update(x, session=s, sample_rate=sr)
+            return
+
+        x = np.asarray(data, dtype=np.float64)
+        if x.ndim < 2:
+            x = np.reshape(x, [1, -1])
+        assert x.shape[1] == self.n_elecs, 'number of columns must match the number of electrodes'
+        if not (sample_rate is None):
+            self.sample_rate[session] = sample_rate
+        if x.shape[0] == 0:
+            return
+
+        n = x.shape[0]
+        mean = np.mean(x, axis=0)
+        x = x - mean
+        cross_products = np.dot(x.T, x)
+
+        if not (session in self.n_samples):
+            self.n_samples[session] = n
+            self._means[session] = mean
+            self._cross_products[session] = cross_products
+            return
+
+        #combine the statistics of the accumulated samples and the new chunk
+        n_prev = self.n_samples[session]
+        n_total = n_prev + n
+        delta = mean - self._means[session]
+        self._means[session] += delta * (n / n_total)
+        self._cross_products[session] += cross_products + np.outer(delta, delta) * (n_prev * n / n_total)
+        self.n_samples[session] = n_total
+
+    def get_locs(self):
+        """
+        Gets locations from the accumulator
+        """
+        return self.locs
+
+    def get_dur(self):
+        """
+        Returns the recording time (in seconds, or in samples for sessions without a sample rate) of each session
+        """
+        dur = []
+        for session, n in self.n_samples.items():
+            sample_rate = self.sample_rate.get(session, self.default_sample_rate)
+            dur.append(n / sample_rate if sample_rate else n)
+        return np.array(dur, dtype=np.float64)
+
+    def get_corrmat(self, z_transform=False):
+        """
+        Returns the average correlation matrix across sessions (weighted by recording time)
+
+        Parameters
+        ----------
+        z_transform : bool
+            If True, return the Fisher z-transformed correlation matrix (default: False)
+
+        Returns
+        ----------
+        results : 2D np.ndarray
+            Electrodes x electrodes correlation matrix
+        """
+        assert len(self.n_samples) > 0, 'no data have been accumulated'
+
+        summed_zcorrs = np.zeros([self.n_elecs, self.n_elecs])
+        for session, dur in zip(self.n_samples.keys(), self.get_dur()):
+            cross_products = self._cross_products[session]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                norms = np.sqrt(np.diag(cross_products))
+                corrmat = cross_products / np.outer(norms, norms)
+            np.clip(corrmat, -1., 1., out=corrmat)
+            np.fill_diagonal(corrmat, 1.)
+            summed_zcorrs += dur * _r2z(corrmat)
+
+        zcorrs = summed_zcorrs / np.sum(self.get_dur())
+        if z_transform:
+            return zcorrs
+        return _z2r(zcorrs)
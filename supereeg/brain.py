@@ -60,7 +60,8 @@ class Brain(object):
     ----------
 
     data : pandas.DataFrame
-        Samples x electrodes dataframe containing the EEG data.
+        Samples x electrodes dataframe containing the EEG data (a view of the underlying numpy array, created on
+        demand).
 
     locs : pandas.DataFrame
         Electrode by MNI coordinate (x,y,z) df containing electrode locations.
@@ -87,7 +88,10 @@ class Brain(object):
     label : list
         Label for each session
 
-    kurtosis : int
+    kurtosis : numpy.ndarray
+        Maximum kurtosis (across sessions) of each electrode; computed when first needed
+
+    kurtosis_threshold : int
         Kurtosis threshold
 
     filter : 'kurtosis' or None
@@ -100,6 +104,10 @@ class Brain(object):
     maximum_voxel_size : positive scalar or 3D numpy array
         Used to construct Nifti objects; default: 20 (mm)
 
+    dtype : numpy dtype or None
+        The data are stored in a contiguous numpy array of this (floating point) dtype; e.g. np.float32 halves the
+        memory used by the data.  If None (default), np.float64 is used.
+
 
     Returns
     ----------
@@ -112,7 +120,7 @@ class Brain(object):
     def __init__(self, data=None, locs=None, sessions=None, sample_rate=None,
                  meta=None, date_created=None, label=None, kurtosis=None,
                  kurtosis_threshold=10, minimum_voxel_size=3, maximum_voxel_size=20,
-                 filter='kurtosis'):
+                 filter='kurtosis', dtype=None):
 
         from .load import load
         from .model import Model
@@ -123,7 +131,7 @@ class Brain(object):
 
         if isinstance(data, Brain):
             self.__dict__.update(data.__dict__)
-            self.update_filter_inds()
+            self._filtered = {}
             self.update_info()
             self = data
 
@@ -137,10 +145,11 @@ class Brain(object):
                 locs = data.locs
                 data = data.get_model(z_transform=False)
 
-            if isinstance(data, pd.DataFrame):
-                self.data = data
-            else:
-                self.data = pd.DataFrame(data)
+            if dtype is None:
+                dtype = np.float64
+            self.dtype = np.dtype(dtype)
+            assert self.dtype.kind == 'f', 'dtype must be a real floating point type'
+            self.data = data
 
             if isinstance(locs, pd.DataFrame):
                 assert all(locs.columns == ['x', 'y', 'z'])
@@ -204,10 +213,10 @@ class Brain(object):
             if np.iterable(kurtosis):
                 self.kurtosis = kurtosis
             else:
-                self.kurtosis = _kurt_vals(self)
+                self.kurtosis = None #computed when first needed (see the kurtosis property)
             self.kurtosis_threshold = kurtosis_threshold
             self.filter=filter
-            self.filter_inds = self.update_filter_inds()
+            self.filter_inds = None #updated (lazily) by update_filter_inds
 
             if not label:
                 self.label = len(self.locs) * ['observed']
@@ -217,6 +226,137 @@ class Brain(object):
             self.minimum_voxel_size = minimum_voxel_size
             self.maximum_voxel_size = maximum_voxel_size
 
+    @property
+    def kurtosis(self):
+        """
+        Maximum kurtosis (across sessions) of each electrode.  The kurtosis is computed the first time it is needed
+        (e.g. when the kurtosis filter is first applied) and then cached.
+        """
+        if self._kurtosis is None:
+            self._kurtosis = _kurt_vals(self)
+        return self._kurtosis
+
+    @kurtosis.setter
+    def kurtosis(self, value):
+        if np.iterable(value):
+            value = np.asarray(value)
+        self._kurtosis = value
+
+    @property
+    def data(self):
+        if self._data_frame is None:
+            self._data_frame = pd.DataFrame(self._data, index=self._data_index, columns=self._data_columns, copy=False)
+        return self._data_frame
+
+    @data.setter
+    def data(self, value):
+        dtype = getattr(self, 'dtype', np.dtype(np.float64))
+        if isinstance(value, pd.DataFrame):
+            values = value.values
+            self._data_index, self._data_columns = value.index, value.columns
+        else:
+            values = value
+            self._data_index, self._data_columns = None, None
+        values = np.asarray(values)
+        if values.ndim < 2:
+            values = np.reshape(values, [-1, 1])
+
+        self._data = np.ascontiguousarray(values, dtype=dtype)
+        if isinstance(value, pd.DataFrame) and (self._data is values):
+            self._data_frame = value #the dataframe is already a view of a contiguous array of the right dtype
+        else:
+            self._data_frame = None
+
+    def _get_values(self):
+        """
+        Internal function that returns the (filtered) data as a numpy array, without copying it if no electrodes are
+        filtered out
+        """
+        self.update_filter_inds()
+        inds = self.filter_inds.ravel()
+        if np.all(inds):
+            return self._data
+        return self._data[:, inds]
+
+    def _session_inds(self):
+        """
+        Internal function that returns a list of (session, indices) tuples (in the order given by
+        self.sessions.unique()), where the indices of each session's samples are given as a slice if they are
+        contiguous (so that indexing the data does not copy it).  The result is cached until self.sessions is
+        replaced.
+        """
+        cached = getattr(self, '_session_cache', None)
+        if (cached is None) or not (cached[0] is self.sessions):
+            sessions = np.asarray(self.sessions)
+            results = []
+            for session in self.sessions.unique():
+                inds = np.where(sessions == session)[0]
+                if (len(inds) > 0) and (inds[-1] - inds[0] + 1 == len(inds)):
+                    inds = slice(int(inds[0]), int(inds[-1]) + 1)
+                results.append((session, inds))
+            cached = (self.sessions, results)
+            self._session_cache = cached
+        return cached[1]
+
+    def groupby(self, by='session', filtered=True):
+        """
+        Groups the samples of the brain object by session
+
+        Parameters
+        ----------
+        by : 'session'
+            What to group the samples by (only 'session' is supported)
+
+        filtered : bool
+            If True (default), only the electrodes that pass the filter are included
+
+        Returns
+        ----------
+        groups : _SessionGroups
+            An iterable of (session, data) tuples (in the order given by sessions.unique()), where data is a samples x
+            electrodes numpy array (a view of the brain object's data if the session's samples are contiguous).
+            Transforms can be applied to each session using groups.apply, groups.stack, and groups.reduce.
+        """
+        assert by == 'session', 'Only grouping by session is supported'
+        return _SessionGroups(self, filtered=filtered)
+
+    def windows(self, length=1, stride=None, overlap=None, filtered=True):
+        """
+        Iterates over (sliding) windows of the brain object's data
+
+        Unlike iterating over the brain object itself (which yields a brain
+        object for each sample), this yields numpy arrays, which are views of
+        the brain object's data whenever the session's samples are contiguous.
+        Windows do not span session boundaries.
+
+        Parameters
+        ----------
+        length : int
+            Number of samples in each window (default: 1, i.e. iterate over samples)
+
+        stride : int or None
+            Number of samples between the starts of consecutive windows.  If None (default), the stride is
+            length - overlap.
+
+        overlap : int or None
+            Number of samples shared by consecutive windows (default: 0).  Ignored if stride is given.
+
+        filtered : bool
+            If True (default), only the electrodes that pass the filter are included
+
+        Returns
+        ----------
+        windows : generator
+            Yields length x electrodes numpy arrays (in the order given by sessions.unique())
+        """
+        if stride is None:
+            stride = length - (overlap or 0)
+        assert length > 0, 'window length must be positive'
+        assert stride > 0, 'stride must be positive (overlap must be smaller than the window length)'
+
+        return (x[start:start + length] for session, x in self.groupby('session', filtered=filtered)
+                for start in range(0, x.shape[0] - length + 1, stride))
+
     def __getitem__(self, slice):
         if isinstance(slice, tuple):
             timeslice, locslice = slice
@@ -230,9 +370,9 @@ class Brain(object):
         return self
 
     def __next__(self):
-        if self.counter >= self.data.shape[0]:
+        if self.counter >= self._data.shape[0]:
             raise StopIteration
-        s = self[self.counter]
+        s = self.get_slice(sample_inds=slice(self.counter, self.counter + 1))
         self.counter+=1
         return s
 
@@ -285,13 +425,22 @@ class Brain(object):
         x = copy.copy(self.__dict__)
         x['data'] = self.get_data()
         x['locs'] = self.get_locs()
+        #when no electrodes are filtered out, get_data and get_locs return this brain object's own dataframes
+        if x['data'] is self.data:
+            x['data'] = x['data'].copy()
+        if x['locs'] is self.locs:
+            x['locs'] = x['locs'].copy()
 
         if self.filter == 'kurtosis':
-            x['kurtosis'] = x['kurtosis'][x['kurtosis'] <= x['kurtosis_threshold']]
+            x['kurtosis'] = self.kurtosis[self.kurtosis <= self.kurtosis_threshold]
+        else:
+            x['kurtosis'] = self._kurtosis
 
         for key in ['n_subs', 'n_elecs', 'n_sessions', 'dur', 'filter_inds']:
             if key in x.keys():
                 x.pop(key)
+        for key in [k for k in x.keys() if k.startswith('_')]: #private (storage and cached) attributes
+            x.pop(key)
 
         boc = Brain(**x)
         boc.filter = None
@@ -301,12 +450,36 @@ class Brain(object):
         else:
             return boc
 
-    def get_data(self):
+    def _get_filtered(self, name):
         """
-        Gets data from brain object
+        Internal function that returns the filtered data (name='data') or locations (name='locs').  The result is
+        cached until self.data (or self.locs) is replaced or the filter changes; when no electrodes are filtered out
+        (and the index is already reset), the unfiltered dataframe is returned without copying it.
         """
         self.update_filter_inds()
-        return self.data.iloc[:, self.filter_inds.ravel()].reset_index(drop=True)
+        x = getattr(self, name)
+        inds = self.filter_inds.ravel()
+        if not hasattr(self, '_filtered'):
+            self._filtered = {}
+        cached = self._filtered.get(name)
+        if (cached is None) or not ((cached[0] is x) and np.array_equal(cached[1], inds)):
+            if np.all(inds) and x.index.equals(pd.RangeIndex(x.shape[0])):
+                filtered = x
+            elif name == 'data':
+                filtered = x.iloc[:, inds].reset_index(drop=True)
+            else:
+                filtered = x.iloc[inds, :].reset_index(drop=True)
+            cached = (x, inds.copy(), filtered)
+            self._filtered[name] = cached
+        return cached[2]
+
+    def get_data(self):
+        """
+        Gets data from brain object.  When no electrodes are filtered out, the returned dataframe is this brain
+        object's data (self.data) rather than a copy, so it should not be modified in place; use apply_filter to get
+        an independent copy.
+        """
+        return self._get_filtered('data')
 
     def get_zscore_data(self):
         """
@@ -317,21 +490,27 @@ class Brain(object):
 
     def get_locs(self):
         """
-        Gets locations from brain object
+        Gets locations from brain object.  As with get_data, when no electrodes are filtered out the returned
+        dataframe is this brain object's locations (self.locs), so it should not be modified in place.
         """
-        self.update_filter_inds()
-        return self.locs.iloc[self.filter_inds.ravel(), :].reset_index(drop=True)
+        return self._get_filtered('locs')
 
     def get_slice(self, sample_inds=None, loc_inds=None, inplace=False):
         """
         Indexes brain object data
 
+        The sliced brain object gets a (shallow) copy of this brain object's
+        meta data, and its data are a view of this brain object's data whenever
+        numpy allows it (i.e. when the samples are given as a slice and all
+        electrodes are kept), so the slice's data should not be modified in
+        place.
+
         Parameters
         ----------
-        sample_inds : int or list
+        sample_inds : int, slice or list
             Times you wish to index
 
-        loc_inds : int or list
+        loc_inds : int, slice or list
             Locations you with to index
 
         inplace : bool
@@ -339,28 +518,63 @@ class Brain(object):
 
         """
         if sample_inds is None:
-            sample_inds = list(self.get_data().index)
+            sample_inds = slice(None)
         if loc_inds is None:
-            loc_inds = list(self.get_locs().index)
-        if isinstance(sample_inds, int):
+            loc_inds = slice(None)
+        if isinstance(sample_inds, (int, np.integer)):
             sample_inds = [sample_inds]
-        if isinstance(loc_inds, int):
+        if isinstance(loc_inds, (int, np.integer)):
             loc_inds = [loc_inds]
 
-        data = self.get_data().iloc[sample_inds, loc_inds].reset_index(drop=True)
-        sessions = self.sessions.iloc[sample_inds]
-        kurtosis = self.kurtosis[self.get_locs().index[loc_inds]]
+        self.update_filter_inds()
+        filter_inds = self.filter_inds.ravel()
+        n_elecs = self._data.shape[1]
+        data = self._data[sample_inds]
+        if np.all(filter_inds):
+            elec_inds = np.arange(n_elecs)[loc_inds]
+            all_elecs = isinstance(loc_inds, slice) and (len(elec_inds) == n_elecs)
+            if not all_elecs:
+                data = data[:, loc_inds]
+        else:
+            all_elecs = False
+            elec_inds = np.where(filter_inds)[0][loc_inds]
+            data = data[:, elec_inds]
+
+        #the kurtosis of the full recording is computed (once) and cached on this brain object
+        kurtosis = self.kurtosis[elec_inds]
+
+        sessions = self.sessions.values[sample_inds]
+        unique_sessions, first_inds, counts = np.unique(sessions, return_index=True, return_counts=True)
         if self.sample_rate:
             sample_rate = [self.sample_rate[int(s-1)] for s in
-                           sessions.unique()]
+                           unique_sessions[np.argsort(first_inds)]]
+            dur = np.true_divide(counts, np.array(sample_rate))
         else:
             sample_rate = self.sample_rate
-        meta = copy.copy(self.meta)
-        locs = self.get_locs().iloc[loc_inds].reset_index(drop=True)
-        date_created = time.strftime("%c")
+            dur = 0 if data.shape[0] == 1 else None
+
+        #build the slice directly (rather than through __init__), starting from this brain object's attributes
+        b = Brain.__new__(Brain)
+        b.__dict__.update(dict((k, v) for k, v in self.__dict__.items() if not k.startswith('_')))
+        b.data = data
+        if all_elecs:
+            b._data_columns = self._data_columns
+            b.locs = self.locs
+        else:
+            columns = self._data_columns if self._data_columns is not None else pd.RangeIndex(n_elecs)
+            b._data_columns = columns[elec_inds]
+            b.locs = self.locs.iloc[elec_inds].reset_index(drop=True)
+        b.sessions = pd.Series(sessions)
+        b.sample_rate = sample_rate
+        b.kurtosis = kurtosis
+        b.meta = copy.copy(self.meta)
+        b.filter = None
+        b.filter_inds = None
+        b.label = len(elec_inds) * ['observed']
+        b.n_elecs = data.shape[1]
+        b.n_sessions = len(unique_sessions)
+        b.dur = dur
 
-        b = Brain(data=data, locs=locs, sessions=sessions, sample_rate=sample_rate, meta=meta, date_created=date_created,
-                  filter=None, kurtosis=kurtosis)
         if inplace:
             self = b
         else:
@@ -630,9 +844,74 @@ class Brain(object):
             'maximum_voxel_size': self.maximum_voxel_size,
             'label' : self.label,
             'filter' : self.filter,
+            'dtype' : self.dtype.name,
         }
 
         if fname[-3:] != '.bo':
             fname += '.bo'
 
         dd.io.save(fname, bo, compression=compression)
+
+
+class _SessionGroups(object):
+    """
+    Session groups of a brain object (see Brain.groupby).  The session offsets are computed once (and cached by the
+    brain object), and each session's data is a view of the brain object's data whenever possible.
+    """
+    def __init__(self, bo, filtered=True):
+        self.bo = bo
+        self.groups = bo._session_inds()
+        self.data = bo._get_values() if filtered else bo._data
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        for session, inds in self.groups:
+            yield session, self.data[inds]
+
+    def sample_rates(self):
+        """
+        Returns the sample rate of each session (or None if the brain object has no sample rate)
+        """
+        if not self.bo.sample_rate:
+            return [None] * len(self)
+        return [self.bo.sample_rate[i] for i in range(len(self))]
+
+    def apply(self, xform):
+        """
+        Returns a list containing xform applied to each session's data
+        """
+        return [xform(x) for session, x in self]
+
+    def stack(self, xform, n_rows=None):
+        """
+        Applies xform to each session's data and stacks the (2D) results vertically into a single preallocated array.
+        n_rows lists the number of rows returned by xform for each session (default: the number of samples in each
+        session).
+        """
+        if n_rows is None:
+            n_rows = [x.shape[0] for session, x in self]
+        offsets = np.concatenate([[0], np.cumsum(n_rows)]).astype(np.int64)
+
+        out = None
+        for i, (session, x) in enumerate(self):
+            result = xform(x)
+            if out is None:
+                out = np.empty([offsets[-1], result.shape[1]], dtype=result.dtype)
+            out[offsets[i]:offsets[i + 1], :] = result
+        return out
+
+    def reduce(self, xform, ufunc=np.add):
+        """
+        Applies xform to each session's data and combines the results in place (into a preallocated array) using the
+        given binary ufunc (default: np.add)
+        """
+        out = None
+        for session, x in self:
+            result = xform(x)
+            if out is None:
+                out = np.array(result, dtype=np.result_type(result, np.float64))
+            else:
+                ufunc(out, result, out=out)
+        return out
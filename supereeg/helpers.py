@@ -1,15 +1,13 @@
 from __future__ import division
 from __future__ import print_function
 
-#TODO: there are multiple implementations of functions like _apply_by_file_index.  these should be consolidated into one
-#common function that is used and called multiple times.  In addition, aggregator and transform functions that are used
-#across apply_by_file wrappers should be shared (rather than defined multiple times).  We could also call_apply_by_file_index
-#"groupby" to conform to the pandas style.  e.g. bo.groupby(session) returns a generator whose produces are brain objects
-#each of one session.  we could then use bo.groupby(session).aggregate(xform) to produce a list of objects, where each is
-#comprised of the xform applied to the brain object containing one session worth of data from the original object.
+#NOTE: session-wise computations should use bo.groupby('session') (see brain.py), which computes the session offsets
+#once and applies transforms to (views of) each session's data.
 
 import copy
 import os
+import glob
+import six
 import numpy.matlib as mat
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -24,12 +22,14 @@ import warnings
 from nilearn import plotting as ni_plt
 from nilearn import image
 from nilearn.input_data import NiftiMasker
-from scipy.stats import kurtosis, zscore, pearsonr
+from scipy.stats import zscore, pearsonr
 from scipy.spatial.distance import pdist
 from scipy.spatial.distance import cdist
-from scipy.spatial.distance import squareform
+from scipy.spatial import cKDTree
+from scipy import sparse
 from scipy.special import logsumexp
 from scipy import linalg
+from scipy.optimize import linear_sum_assignment
 from scipy.ndimage.interpolation import zoom
 try:
     from itertools import zip_longest
@@ -149,56 +149,48 @@ def _resample_nii(x, target_res, precision=5):
     return Nifti(z, target_affine)
 
 
-def _apply_by_file_index(bo, xform, aggregator):
+def _kurt_vals(bo):
     """
-    Session dependent function application and aggregation
+    Function that calculates maximum kurtosis values for each channel
 
     Parameters
     ----------
     bo : Brain object
         Contains data
 
-    xform : function
-        The function to apply to the data matrix from each filename
-
-    aggregator: function
-        Function for aggregating results across multiple iterations
-
     Returns
     ----------
-    results : numpy ndarray
-         Array of aggregated results
+    results: 1D ndarray
+        Maximum kurtosis across sessions for each channel
 
     """
+    return bo.groupby('session', filtered=False).reduce(_kurtosis, ufunc=np.maximum)
 
-    for idx, session in enumerate(bo.sessions.unique()):
-        session_xform = xform(bo.get_slice(sample_inds=np.where(bo.sessions == session)[0], inplace=False))
-        if idx is 0:
-            results = session_xform
-        else:
-            results = aggregator(results, session_xform)
-
-    return results
 
-
-def _kurt_vals(bo):
+def _kurtosis(x):
     """
-    Function that calculates maximum kurtosis values for each channel
+    Computes the (Fisher, biased) kurtosis of each column of x, equivalent to scipy.stats.kurtosis(x) but computed
+    with a single temporary array (the squared deviations are squared again in place)
 
     Parameters
     ----------
-    bo : Brain object
-        Contains data
+    x : 2D ndarray
+        Samples x electrodes array
 
     Returns
     ----------
     results: 1D ndarray
-        Maximum kurtosis across sessions for each channel
+        Kurtosis of each column (NaN for constant columns, as in scipy, so that they never pass the kurtosis
+        threshold)
 
     """
-    sessions = bo.sessions.unique()
-    results = list(map(lambda s: kurtosis(bo.data[(s==bo.sessions).values]), sessions))
-    return np.max(np.vstack(results), axis=0)
+    d = np.asarray(x, dtype=np.float64) - np.mean(x, axis=0, dtype=np.float64)
+    np.square(d, out=d)
+    m2 = np.mean(d, axis=0)
+    np.square(d, out=d)
+    m4 = np.mean(d, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(m2 == 0, np.nan, m4 / (m2 * m2)) - 3.
 
 
 def _get_corrmat(bo):
@@ -218,16 +210,43 @@ def _get_corrmat(bo):
 
     """
 
-    def aggregate(p, n):
-        return p + n
+    summed_zcorrs = None
+    for session, x in bo.groupby('session'):
+        #weight each session by recording time
+        dur = x.shape[0] / bo.sample_rate[int(session - 1)]
+        next_zcorrs = np.multiply(dur, _r2z(_corrcoef(x)))
+        if summed_zcorrs is None:
+            summed_zcorrs = next_zcorrs
+        else:
+            summed_zcorrs += next_zcorrs
 
-    def zcorr_xform(bo):
-        return np.multiply(bo.dur, _r2z(1 - squareform(pdist(bo.get_data().T, 'correlation'))))
+    return _z2r(summed_zcorrs / np.sum(bo.dur))
 
-    summed_zcorrs = _apply_by_file_index(bo, zcorr_xform, aggregate)
 
-    #weight each session by recording time
-    return _z2r(summed_zcorrs / np.sum(bo.dur))
+def _corrcoef(X):
+    """
+    Function that calculates the correlation matrix of the columns of X
+
+    The columns are standardized once, so the correlations are given by a single matrix product (computed in the
+    dtype of X, e.g. float32).  Correlations involving constant columns are NaN; the diagonal is always 1.
+
+    Parameters
+    ----------
+    X : 2D np.ndarray
+        Samples x electrodes data
+
+    Returns
+    ----------
+    results: 2D np.ndarray
+        Electrodes x electrodes correlation matrix
+    """
+    X = X - np.mean(X, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        X = X / np.sqrt(np.sum(X ** 2, axis=0))
+        results = np.dot(X.T, X).astype(np.float64)
+    np.clip(results, -1., 1., out=results)
+    np.fill_diagonal(results, 1.)
+    return results
 
 
 def _z_score(bo):
@@ -245,13 +264,7 @@ def _z_score(bo):
         The average correlation matrix across sessions
 
     """
-    def z_score_xform(bo):
-        return zscore(bo.get_data())
-
-    def vstack_aggregrate(x1, x2):
-        return np.vstack((x1, x2))
-
-    return _apply_by_file_index(bo, z_score_xform, vstack_aggregrate)
+    return bo.groupby('session').stack(zscore)
 
 
 
@@ -303,7 +316,7 @@ def _r2z(r):
     return 0.5 * (np.log(1 + r) - np.log(1 - r))
 
 
-def _log_rbf(to_coords, from_coords, width=20):
+def _log_rbf(to_coords, from_coords, width=20, cutoff=None):
     """
     Radial basis function
 
@@ -318,16 +331,36 @@ def _log_rbf(to_coords, from_coords, width=20):
     width : positive scalar
         Radius
 
+    cutoff : positive scalar or None
+        If None (default), weights are computed between every pair of coordinates.  Otherwise the kernel is
+        truncated: only pairs of coordinates within cutoff * width of each other (found using a KD-tree) are given
+        weights, and all other weights are treated as zero (i.e. -inf in log units).
+
     Returns
     ----------
-    results : ndarray
-        Matrix of log rbf weights for each subject coordinate for all coordinates
+    results : ndarray or scipy.sparse.csr_matrix
+        Matrix of log rbf weights for each subject coordinate for all coordinates.  If cutoff is specified, a sparse
+        matrix is returned whose stored entries are the log weights of the retained pairs; entries that are not
+        stored have a weight of zero.
 
     """
     assert np.isscalar(width), 'RBF width must be a scalar'
     assert width > 0, 'RBF width must be positive'
-    weights = -cdist(to_coords, from_coords, metric='euclidean') ** 2 / float(width)
-    return weights
+    if cutoff is None:
+        weights = -cdist(to_coords, from_coords, metric='euclidean') ** 2 / float(width)
+        return weights
+
+    assert np.isscalar(cutoff), 'RBF cutoff must be a scalar'
+    assert cutoff > 0, 'RBF cutoff must be positive'
+    to_coords = np.asarray(to_coords, dtype=np.float64)
+    from_coords = np.asarray(from_coords, dtype=np.float64)
+
+    neighbors = cKDTree(from_coords).query_ball_point(to_coords, r=cutoff * width)
+    indptr = np.cumsum([0] + [len(x) for x in neighbors])
+    indices = np.array([i for x in neighbors for i in sorted(x)], dtype=np.int64)
+    rows = np.repeat(np.arange(to_coords.shape[0]), np.diff(indptr))
+    data = -np.sum((to_coords[rows, :] - from_coords[indices, :]) ** 2, axis=1) / float(width)
+    return sparse.csr_matrix((data, indices, indptr), shape=(to_coords.shape[0], from_coords.shape[0]))
 
 
 def tal2mni(r):
@@ -359,21 +392,29 @@ def tal2mni(r):
     return np.round(inpoints[0:3, :].T, decimals=2)
 
 
-def _blur_corrmat(Z, weights):
+def _blur_corrmat(Z, weights, block_size=None):
     """
     Gets full correlation matrix
 
+    The numerator and denominator are computed for all pairs of target locations at once.  Because the RBF weight of
+    source pair (i, j) for target pair (x, y) is separable (exp(w[x, i] + w[y, j])), each row block of the expanded
+    matrices is a pair of matrix products.  Weights are shifted by their row-wise maximum before exponentiating so
+    that the products are computed in a numerically stable way; any entries that underflow are recomputed exactly
+    in log space.
+
     Parameters
     ----------
     Z : Numpy array
         Subject's Fisher z-transformed correlation matrix
 
-    weights : Numpy array
-        Weights matrix calculated using _log_rbf function matrix
+    weights : Numpy array or scipy.sparse matrix
+        Weights matrix calculated using _log_rbf function matrix.  If a (truncated) sparse weights matrix is given,
+        only target locations with at least one non-zero weight are blurred (directly from the sparse weights);
+        entries for all other locations are set to -inf (in log units).  The returned matrices are dense either way.
 
-    mode : str
-        Specifies whether to compute over all elecs (fit mode) or just new elecs
-        (predict mode)
+    block_size : int or None
+        Number of target locations to process at a time.  If None (default), the block size is chosen to keep
+        temporary arrays under ~10 million elements.
 
     Returns
     ----------
@@ -382,60 +423,434 @@ def _blur_corrmat(Z, weights):
     denominator : Numpy array
         Denominator for the expanded correlation matrix
     """
-    #import seaborn as sns
-    #import matplotlib.pyplot as plt
-
-    triu_inds = np.triu_indices(Z.shape[0], k=1)
-
-    #need to do computations seperately for positive and negative values
-    sign_Z_full = np.sign(Z)
-    #logZ_pos_full = np.log(np.multiply(sign_Z_full > 0, Z))
-    #logZ_neg_full = np.log(np.multiply(sign_Z_full < 0, np.abs(Z)))
-
-    sign_Z = sign_Z_full[triu_inds]
-    logZ_pos = np.log(np.multiply(sign_Z > 0, Z[triu_inds]))
-    logZ_neg = np.log(np.multiply(sign_Z < 0, np.abs(Z[triu_inds])))
+    is_sparse = sparse.issparse(weights)
+    if is_sparse:
+        weights = weights.tocsr()
+        n = weights.shape[0]
+        active = np.where(np.diff(weights.indptr) > 0)[0]
+
+        if len(active) < n:
+            K = np.full([n, n], complex(-np.inf, -np.inf), dtype=np.complex128)
+            W = np.full([n, n], -np.inf)
+            np.fill_diagonal(K, 0)
+            np.fill_diagonal(W, 0)
+            if len(active) > 0:
+                K_active, W_active = _blur_corrmat(Z, weights[active, :], block_size=block_size)
+                K[np.ix_(active, active)] = K_active
+                W[np.ix_(active, active)] = W_active
+            return K, W
 
     n = weights.shape[0]
+    if block_size is None:
+        block_size = int(max(1, 1e7 // max(n, 1)))
+
+    #need to do computations seperately for positive and negative values; only the upper triangle of Z contributes
+    upper = np.triu(np.ones(Z.shape, dtype=bool), k=1)
+    Z_pos = np.where(upper & (Z > 0), Z, 0.)
+    Z_neg = np.where(upper & (Z < 0), np.abs(Z), 0.)
+
+    #E (and finite) are sparse if the weights are; every row of sparse weights has at least one stored entry
+    if is_sparse:
+        shift = np.maximum.reduceat(weights.data, weights.indptr[:-1])
+        E = weights.copy()
+        E.data = np.exp(weights.data - np.repeat(shift, np.diff(weights.indptr)))
+        finite = weights.copy()
+        finite.data = np.ones_like(finite.data)
+        dense = False
+    else:
+        shift = np.max(weights, axis=1)
+        shift[~np.isfinite(shift)] = 0.
+        E = np.exp(weights - shift[:, np.newaxis])
+        #entries that are non-zero in exact arithmetic; a zero product at one of these locations has underflowed
+        finite = np.isfinite(weights).astype(np.float64)
+        dense = np.all(finite)
+
+    #right-hand factors (sources x targets), shared by every row block
+    R_w = E.dot(upper.T.astype(np.float64)).T
+    R_pos = E.dot(Z_pos.T).T
+    R_neg = E.dot(Z_neg.T).T
+
+    if dense:
+        S_w, S_pos, S_neg = np.any(upper), np.any(Z_pos > 0), np.any(Z_neg > 0)
+    else:
+        S_w = finite.dot(upper.T.astype(np.float64)).T
+        S_pos = finite.dot((Z_pos > 0).T.astype(np.float64)).T
+        S_neg = finite.dot((Z_neg > 0).T.astype(np.float64)).T
+
     K_pos = np.zeros([n, n])
     K_neg = np.zeros([n, n])
     W = np.zeros([n, n])
 
-    for x in range(n-1):
-        xweights = weights[x, :]
-        x_match = np.isclose(xweights, 0)
-        for y in range(x+1, n): #fill in upper triangle only
-            yweights = weights[y, :]
-            y_match = np.isclose(yweights, 0)
-
-            if np.any(x_match) and np.any(y_match): #the pair of locations we're filling in already exists in the given data
-                x_ind = np.where(x_match)[0]
-                y_ind = np.where(y_match)[0]
-                Z_match_val = np.mean(Z[x_ind, y_ind])
-                W[x, y] = 0.
-                if Z_match_val > 0:
-                    K_pos[x, y] = np.log(Z_match_val)
-                    K_neg[x, y] = -np.inf
+    with np.errstate(divide='ignore'):
+        for start in range(0, n, block_size):
+            rows = np.arange(start, min(start + block_size, n))
+            in_triu = np.arange(n)[np.newaxis, :] > rows[:, np.newaxis] #fill in upper triangle only
+            offset = shift[rows, np.newaxis] + shift[np.newaxis, :]
+
+            for R, S, out in ((R_w, S_w, W), (R_pos, S_pos, K_pos), (R_neg, S_neg, K_neg)):
+                prod = E[rows, :].dot(R)
+                if dense:
+                    lost = (prod == 0) & in_triu & S
                 else:
-                    K_pos[x, y] = -np.inf
-                    K_neg[x, y] = np.log(np.abs(Z_match_val))
-                continue
+                    lost = (prod == 0) & in_triu & (finite[rows, :].dot(S) > 0)
+                out[rows, :] = np.where(in_triu, np.log(prod) + offset, 0.)
+
+                if np.any(lost):
+                    xs, ys = np.where(lost)
+                    #only the (dense) weights of the affected target locations are needed
+                    needed = np.union1d(rows[xs], ys)
+                    out[rows[xs], ys] = _blur_pairs(Z, _dense_log_weights(weights[needed, :]),
+                                                    np.searchsorted(needed, rows[xs]), np.searchsorted(needed, ys),
+                                                    R is R_pos, R is R_neg)
+
+    #pairs of locations that already exist in the given data take on their observed values
+    if is_sparse:
+        close = np.isclose(weights.data, 0)
+        close_rows = np.repeat(np.arange(n), np.diff(weights.indptr))[close]
+        matched, first = np.unique(close_rows, return_index=True)
+        src = weights.indices[close][first]
+    else:
+        match = np.isclose(weights, 0)
+        matched = np.where(np.any(match, axis=1))[0]
+        src = np.argmax(match[matched, :], axis=1)
+    if len(matched) > 1:
+        pairs = np.triu(np.ones([len(matched), len(matched)], dtype=bool), k=1)
+        xs = matched[np.where(pairs)[0]]
+        ys = matched[np.where(pairs)[1]]
+        Z_match_vals = Z[src[np.where(pairs)[0]], src[np.where(pairs)[1]]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            W[xs, ys] = 0.
+            K_pos[xs, ys] = np.where(Z_match_vals > 0, np.log(Z_match_vals), -np.inf)
+            K_neg[xs, ys] = np.where(Z_match_vals > 0, -np.inf, np.log(np.abs(Z_match_vals)))
+
+    #store K_neg in the complex part of K
+    K = np.zeros([n, n], dtype=np.complex128)
+    K.real = K_pos
+    K.imag = K_neg
 
-            next_weights = np.add.outer(xweights, yweights)
-            next_weights = next_weights[triu_inds]
+    return K + K.T, W + W.T
 
-            W[x, y] = logsumexp(next_weights)
-            K_pos[x, y] = logsumexp(logZ_pos + next_weights)
-            K_neg[x, y] = logsumexp(logZ_neg + next_weights)
 
-    #turn K_neg into complex numbers.  Where K_neg is infinite, this results in nans for the real number parts, so we'll
-    #set any nans in K_neg.real to 0
-    #TODO: the next lines are redundant with code in _to_log_complex; consolidate
-    K_neg = np.multiply(0+1j, K_neg)
-    K_neg.real[np.isnan(K_neg)] = 0
-    K = K_pos + K_neg
+def _expand_corrmat(Z, weights, added, block_size=None):
+    """
+    Blurs a correlation matrix onto a superset of its locations, computing only the rows and columns of the added
+    locations
 
-    return K + K.T, W + W.T
+    The result is the same as _blur_corrmat(Z, weights), but pairs of existing locations take on their values in Z
+    directly, so only the (new vs. existing and new vs. new) entries of the added locations need to be blurred.
+
+    Parameters
+    ----------
+    Z : Numpy array
+        Fisher z-transformed correlation matrix at the existing locations
+
+    weights : Numpy array or scipy.sparse matrix
+        Weights matrix (from the new set of locations to the existing locations) calculated using _log_rbf
+
+    added : Numpy array
+        Indices (rows of weights) of the locations that are not in the existing set of locations
+
+    block_size : int or None
+        Number of target locations to process at a time.  If None (default), the block size is chosen to keep
+        temporary arrays under ~10 million elements.
+
+    Returns
+    ----------
+    numerator : Numpy array
+        Numerator for the expanded correlation matrix
+    denominator : Numpy array
+        Denominator for the expanded correlation matrix
+    """
+    weights = _dense_log_weights(weights)
+    n = weights.shape[0]
+    added = np.asarray(added, dtype=np.int64)
+    kept = np.setdiff1d(np.arange(n), added)
+
+    match = np.isclose(weights[kept, :], 0)
+    if not np.all(np.any(match, axis=1)): #existing locations must coincide with sources
+        return _blur_corrmat(Z, weights, block_size=block_size)
+
+    K = np.zeros([n, n], dtype=np.complex128)
+    W = np.zeros([n, n])
+
+    src = np.argmax(match, axis=1)
+    K[np.ix_(kept, kept)] = _to_log_complex(Z[np.ix_(src, src)])
+
+    K_added, W_added = _blur_added(Z, weights, added, block_size=block_size)
+    K[added, :] = K_added
+    K[:, added] = K_added.T
+    W[added, :] = W_added
+    W[:, added] = W_added.T
+    np.fill_diagonal(K, 0)
+    np.fill_diagonal(W, 0)
+    return K, W
+
+
+def _blur_added(Z, weights, added, block_size=None, cols=None):
+    """
+    Computes the rows of the added locations of the expanded correlation matrix (see _expand_corrmat)
+
+    Parameters
+    ----------
+    Z : Numpy array
+        Fisher z-transformed correlation matrix at the existing locations (or, if cols is specified, the given
+        columns of that matrix)
+
+    weights : Numpy array or scipy.sparse matrix
+        Weights matrix (from the new set of locations to the existing locations) calculated using _log_rbf.  Sparse
+        weights are not converted to a dense matrix (only the rows of the added locations are).
+
+    added : Numpy array
+        Indices (rows of weights) of the locations that are not in the existing set of locations
+
+    block_size : int or None
+        Number of target locations to process at a time.  If None (default), the block size is chosen to keep
+        temporary arrays under ~10 million elements.
+
+    cols : Numpy array or None
+        If specified, Z contains only these columns of the correlation matrix.  The added locations must have zero
+        weight (-inf in log units) for every other existing location (e.g. cols may be the existing locations
+        within the cutoff of a truncated RBF), and may not coincide with existing locations.
+
+    Returns
+    ----------
+    numerator : Numpy array
+        Rows of the numerator for the added locations (len(added) by number of locations)
+    denominator : Numpy array
+        Rows of the denominator for the added locations
+    """
+    if sparse.issparse(weights):
+        weights = weights.tocsr()
+    n = weights.shape[0]
+    added = np.asarray(added, dtype=np.int64)
+    added_weights = _dense_log_weights(weights[added, :])
+
+    if np.any(np.isclose(added_weights, 0)): #added locations coincide with sources
+        assert cols is None, 'the full correlation matrix is needed when added locations coincide with sources'
+        K, W = _blur_corrmat(Z, weights, block_size=block_size)
+        return K[added, :], W[added, :]
+
+    #the blurred value of a pair of locations depends on which of the two comes first
+    K_upper, W_upper = _blur_cross(Z, weights, added_weights, block_size=block_size, cols=cols)
+    K_lower, W_lower = _blur_cross(Z, weights, added_weights, lower=True, block_size=block_size, cols=cols)
+    before = np.arange(n)[:, np.newaxis] < added[np.newaxis, :]
+    K_added = np.where(before, K_upper, K_lower).T
+    W_added = np.where(before, W_upper, W_lower).T
+
+    K_added[np.arange(len(added)), added] = 0
+    W_added[np.arange(len(added)), added] = 0
+    return K_added, W_added
+
+
+def _blur_cross(Z, row_weights, col_weights, lower=False, block_size=None, cols=None):
+    """
+    Blurs a correlation matrix onto every pair of a row target location and a column target location
+
+    This computes a rectangular block of the (unsymmetrized) expanded numerator and denominator computed by
+    _blur_corrmat, which makes it possible to add a few locations to an existing model without re-blurring the full
+    matrix.  The column target locations should be the smaller set, since their products with Z are precomputed.
+
+    Parameters
+    ----------
+    Z : Numpy array
+        Subject's Fisher z-transformed correlation matrix (or, if cols is specified, the given columns of that
+        matrix)
+
+    row_weights : Numpy array or scipy.sparse matrix
+        Weights (calculated using _log_rbf) for the row target locations.  Sparse row weights are not converted to a
+        dense matrix.
+
+    col_weights : Numpy array or scipy.sparse matrix
+        Weights (calculated using _log_rbf) for the column target locations
+
+    lower : bool
+        If False (default), sum over source pairs (i, j) in the upper triangle of Z, i.e. the row target location
+        precedes the column target location in the full matrix.  If True, sum over the lower triangle of Z (the column
+        target location precedes the row target location).
+
+    block_size : int or None
+        Number of row target locations to process at a time.  If None (default), the block size is chosen to keep
+        temporary arrays under ~10 million elements.
+
+    cols : Numpy array or None
+        If specified, Z contains only these columns of the correlation matrix, and the column target locations have
+        zero weight (-inf in log units) for every other source location.
+
+    Returns
+    ----------
+    numerator : Numpy array
+        Numerator for each pair of locations
+    denominator : Numpy array
+        Denominator for each pair of locations
+    """
+    row_sparse = sparse.issparse(row_weights)
+    if row_sparse:
+        row_weights = row_weights.tocsr()
+    col_weights = _dense_log_weights(col_weights)
+    p, q = row_weights.shape[0], col_weights.shape[0]
+    if block_size is None:
+        block_size = int(max(1, 1e7 // max(q, row_weights.shape[1], 1)))
+
+    if cols is None:
+        mask = np.triu(np.ones(Z.shape, dtype=bool), k=1)
+        if lower:
+            mask = mask.T
+        sub_weights = col_weights
+    else:
+        cols = np.asarray(cols, dtype=np.int64)
+        sources = np.arange(Z.shape[0])[:, np.newaxis]
+        mask = (sources > cols[np.newaxis, :]) if lower else (sources < cols[np.newaxis, :])
+        sub_weights = col_weights[:, cols]
+    Z_pos = np.where(mask & (Z > 0), Z, 0.)
+    Z_neg = np.where(mask & (Z < 0), np.abs(Z), 0.)
+
+    if row_sparse:
+        row_shift = np.zeros(p)
+        stored = np.diff(row_weights.indptr) > 0
+        if np.any(stored):
+            row_shift[stored] = np.maximum.reduceat(row_weights.data, row_weights.indptr[:-1][stored])
+    else:
+        row_shift = np.max(row_weights, axis=1) if row_weights.shape[1] > 0 else np.zeros(p)
+    col_shift = np.max(sub_weights, axis=1) if sub_weights.shape[1] > 0 else np.zeros(q)
+    row_shift[~np.isfinite(row_shift)] = 0.
+    col_shift[~np.isfinite(col_shift)] = 0.
+    E = np.exp(sub_weights - col_shift[:, np.newaxis])
+
+    R_w = np.dot(mask, E.T)
+    R_pos = np.dot(Z_pos, E.T)
+    R_neg = np.dot(Z_neg, E.T)
+
+    #entries that are non-zero in exact arithmetic; a zero product at one of these locations has underflowed
+    finite = np.isfinite(sub_weights).astype(np.float64)
+    S_w = np.dot(mask, finite.T)
+    S_pos = np.dot(Z_pos > 0, finite.T)
+    S_neg = np.dot(Z_neg > 0, finite.T)
+
+    K_pos = np.zeros([p, q])
+    K_neg = np.zeros([p, q])
+    W = np.zeros([p, q])
+
+    with np.errstate(divide='ignore'):
+        for start in range(0, p, block_size):
+            rows = np.arange(start, min(start + block_size, p))
+            offset = row_shift[rows, np.newaxis] + col_shift[np.newaxis, :]
+            if row_sparse:
+                block = row_weights[rows, :]
+                E_rows = block.copy()
+                E_rows.data = np.exp(block.data - np.repeat(row_shift[rows], np.diff(block.indptr)))
+                finite_rows = block.copy()
+                finite_rows.data = np.ones_like(block.data)
+            else:
+                E_rows = np.exp(row_weights[rows, :] - row_shift[rows, np.newaxis])
+                finite_rows = np.isfinite(row_weights[rows, :]).astype(np.float64)
+
+            for R, S, out in ((R_w, S_w, W), (R_pos, S_pos, K_pos), (R_neg, S_neg, K_neg)):
+                prod = E_rows.dot(R)
+                lost = (prod == 0) & (finite_rows.dot(S) > 0)
+                out[rows, :] = np.log(prod) + offset
+
+                if np.any(lost):
+                    xs, ys = np.where(lost)
+                    if not (cols is None): #_blur_pairs needs the full (symmetric) matrix
+                        Z_full = np.zeros([Z.shape[0], Z.shape[0]])
+                        Z_full[cols, :] = Z.T
+                        Z_full[:, cols] = Z
+                        Z, cols = Z_full, None
+                    #only the (dense) weights of the affected row target locations are needed
+                    needed, xs_needed = np.unique(rows[xs], return_inverse=True)
+                    needed_weights = _dense_log_weights(row_weights[needed, :])
+                    if lower: #swap the roles of the row and column locations to sum over the upper triangle
+                        out[rows[xs], ys] = _blur_pairs(Z, col_weights, ys, xs_needed, R is R_pos, R is R_neg,
+                                                        col_weights=needed_weights)
+                    else:
+                        out[rows[xs], ys] = _blur_pairs(Z, needed_weights, xs_needed, ys, R is R_pos, R is R_neg,
+                                                        col_weights=col_weights)
+
+    K = np.zeros([p, q], dtype=np.complex128)
+    K.real = K_pos
+    K.imag = K_neg
+    return K, W
+
+
+def _dense_log_weights(weights):
+    """
+    Converts a (possibly sparse) weights matrix into a dense matrix of log weights
+
+    Parameters
+    ----------
+    weights : Numpy array or scipy.sparse matrix
+        Weights matrix calculated using _log_rbf.  Entries that are not stored in a sparse matrix have a weight of
+        zero (-inf in log units).
+
+    Returns
+    ----------
+    log_weights : Numpy array
+        Dense matrix of log weights
+    """
+    if not sparse.issparse(weights):
+        return weights
+
+    weights = weights.tocsr()
+    log_weights = np.full(weights.shape, -np.inf)
+    log_weights[np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr)), weights.indices] = weights.data
+    return log_weights
+
+
+def _blur_pairs(Z, weights, xs, ys, pos=False, neg=False, max_elements=1e7, col_weights=None):
+    """
+    Computes individual entries of the blurred numerator or denominator directly in log space
+
+    Parameters
+    ----------
+    Z : Numpy array
+        Subject's Fisher z-transformed correlation matrix
+
+    weights : Numpy array
+        Weights matrix calculated using _log_rbf function matrix
+
+    xs : Numpy array
+        Row (target location) indices of the entries to compute
+
+    ys : Numpy array
+        Column (target location) indices of the entries to compute
+
+    pos : bool
+        If True, compute entries of the positive part of the numerator
+
+    neg : bool
+        If True, compute entries of the negative part of the numerator.  If both pos and neg are False, compute
+        entries of the denominator.
+
+    max_elements : int
+        Maximum number of elements in temporary arrays
+
+    col_weights : Numpy array or None
+        If specified, the column indices (ys) refer to rows of col_weights rather than rows of weights
+
+    Returns
+    ----------
+    results : Numpy array
+        The log-space value of each requested entry
+    """
+    if col_weights is None:
+        col_weights = weights
+
+    triu_inds = np.triu_indices(Z.shape[0], k=1)
+    with np.errstate(divide='ignore'):
+        if pos:
+            logZ = np.log(np.where(Z[triu_inds] > 0, Z[triu_inds], 0.))
+        elif neg:
+            logZ = np.log(np.where(Z[triu_inds] < 0, np.abs(Z[triu_inds]), 0.))
+        else:
+            logZ = np.zeros(len(triu_inds[0]))
+
+    chunk = int(max(1, max_elements // max(len(logZ), 1)))
+    results = np.zeros(len(xs))
+    for start in range(0, len(xs), chunk):
+        inds = slice(start, start + chunk)
+        next_weights = weights[xs[inds], :][:, triu_inds[0]] + col_weights[ys[inds], :][:, triu_inds[1]]
+        results[inds] = logsumexp(next_weights + logZ[np.newaxis, :], axis=1)
+    return results
 
 def _to_log_complex(X):
     """
@@ -463,6 +878,101 @@ def _to_log_complex(X):
 
     return posX + negX
 
+def _triu_index(i, j, n):
+    """
+    Returns the index of entry (i, j) of an n x n symmetric matrix stored as a packed (row-major) upper triangle,
+    including the diagonal (see _pack_triu).  i and j may be arrays (with broadcastable shapes).
+    """
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    r, c = np.minimum(i, j), np.maximum(i, j)
+    return r * n - (r * (r - 1)) // 2 + (c - r)
+
+
+def _triu_size(m):
+    """
+    Returns the number of rows/columns of the symmetric matrix stored in a packed upper triangle of length m
+    """
+    n = int(np.round((np.sqrt(8 * m + 1) - 1) / 2))
+    assert n * (n + 1) // 2 == m, 'length ' + str(m) + ' is not a valid packed upper triangle'
+    return n
+
+
+def _pack_triu(X):
+    """
+    Stores the upper triangle (including the diagonal) of a symmetric matrix (or of each matrix in a stack of
+    matrices, along the last two dimensions) as a 1D array
+    """
+    rows, cols = np.triu_indices(X.shape[-1])
+    return X[..., rows, cols]
+
+
+def _unpack_triu(x):
+    """
+    Inverse of _pack_triu
+    """
+    n = _triu_size(x.shape[-1])
+    X = np.empty(x.shape[:-1] + (n, n), dtype=x.dtype)
+    rows, cols = np.triu_indices(n)
+    X[..., rows, cols] = x
+    X[..., cols, rows] = x
+    return X
+
+
+def _to_log_planes(C, dtype=np.float32):
+    """
+    Splits the log of an array stored as complex numbers (see _to_log_complex) into a 2 x ... real array, whose first
+    plane contains the log of the positive parts and whose second plane contains the log of the negative parts
+    """
+    P = np.empty((2,) + C.shape, dtype=dtype)
+    P[0] = C.real
+    P[1] = C.imag
+    return P
+
+
+def _from_log_planes(P):
+    """
+    Inverse of _to_log_planes
+    """
+    C = np.zeros(P.shape[1:], dtype=np.complex128)
+    C.real = P[0]
+    C.imag = P[1]
+    return C
+
+
+def _simplify_log_planes(P, block_size=2**20):
+    """
+    Simplifies log planes (see _to_log_planes) in place, so that each entry has either a finite positive part OR a
+    finite negative part (or neither).  This is the log-space equivalent of _to_log_complex(_to_exp_real(C)), computed
+    block_size entries at a time (to avoid allocating full-sized temporary arrays).
+
+    Parameters
+    ----------
+    P : 2 x ... numpy array of log planes (modified in place if it is C-contiguous)
+
+    block_size : int
+        Number of entries to simplify at once
+
+    Returns
+    ----------
+    P : The simplified log planes
+    """
+    if not P.flags.c_contiguous:
+        P = np.ascontiguousarray(P)
+    flat = P.reshape(2, -1)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for start in range(0, flat.shape[1], block_size):
+            pos = flat[0, start:start + block_size]
+            neg = flat[1, start:start + block_size]
+            hi = np.maximum(pos, neg)
+            mag = hi + np.log1p(-np.exp(np.minimum(pos, neg) - hi)) #log(|exp(pos) - exp(neg)|)
+            pos_wins = pos > neg
+            neg_wins = neg > pos
+            pos[:] = np.where(pos_wins, mag, -np.inf)
+            neg[:] = np.where(neg_wins, mag, -np.inf)
+    return P
+
+
 def _to_exp_real(C):
     """
     Inverse of _to_log_complex
@@ -507,7 +1017,7 @@ def _fill_upper_triangle(M, value):
     return upper_tri
 
 
-def _timeseries_recon(bo, mo, chunk_size=1000, preprocess='zscore'):
+def _timeseries_recon(bo, mo, chunk_size=1000, preprocess='zscore', solver='pinv', ridge=0., target_inds=None):
     """
     Reconstruction done by chunking by session
         Parameters
@@ -521,11 +1031,70 @@ def _timeseries_recon(bo, mo, chunk_size=1000, preprocess='zscore'):
 
     chunk_size : int
         Size to break data into
+
+    solver : 'pinv' or 'cholesky'
+        How the known-to-known correlation matrix is inverted (see _solve_projection)
+
+    ridge : float
+        Regularization added to the diagonal of the known-to-known correlation matrix
+
+    target_inds : list or None
+        Indices of the model locations to return (default: None, return all model locations).  Only the
+        unobserved target locations are reconstructed.
     Returns
     ----------
     results : ndarray
         Compiled reconstructed timeseries
     """
+    data, projection, obs_src, obs_dst, rec_dst, n_out = _recon_operator(bo, mo, preprocess=preprocess,
+                                                                         solver=solver, ridge=ridge,
+                                                                         target_inds=target_inds)
+    if projection is None:
+        #if the model contains all of the locations (or fewer) than what are in the brain object, no reconstructions
+        #are needed
+        return data
+
+    sessions = bo.sessions.unique()
+    try_filter = []
+    chunks = [np.array(i) for session in sessions for i in _chunker(bo.sessions[bo.sessions == session].index.tolist(), chunk_size)]
+    for i in chunks:
+        try_filter.append([x for x in i if x is not None])
+    #predict unobserved brain activitity
+    combined_data = np.zeros((data.shape[0], n_out), dtype=data.dtype)
+    if len(rec_dst) > 0:
+        combined_data[:, rec_dst] = np.vstack(list(map(lambda x: _reconstruct_activity(data[x, :], projection), try_filter)))
+    combined_data[:, obs_dst] = data[:, obs_src]
+
+    for s in sessions:
+        combined_data[bo.sessions==s, :] = zscore(combined_data[bo.sessions==s, :])
+
+    return combined_data
+
+def _recon_operator(bo, mo, preprocess='zscore', solver='pinv', ridge=0., target_inds=None):
+    """
+    Prepares the data in a brain object for reconstruction (see _timeseries_recon)
+
+    Returns
+    ----------
+    data : ndarray
+        (Preprocessed) data, or (if no reconstructions are needed) the data at the model (or target) locations
+
+    projection : ndarray
+        Projection operator from the observed locations to the reconstructed locations (None if no reconstructions
+        are needed)
+
+    obs_src : list
+        Columns of data that are included in the results
+
+    obs_dst : list
+        Columns of the results that hold the data in obs_src
+
+    rec_dst : list
+        Columns of the results that hold the reconstructions (one per row of projection)
+
+    n_out : int
+        Number of columns in the results
+    """
     if preprocess==None:
         data = bo.get_data().as_matrix()
     elif preprocess=='zscore':
@@ -539,20 +1108,39 @@ def _timeseries_recon(bo, mo, chunk_size=1000, preprocess='zscore'):
     else:
         raise('Unsupported preprocessing option: ' + preprocess)
 
-    brain_locs_in_model = _count_overlapping(mo.get_locs(), bo.get_locs())
+    brain_locs_in_model = mo._location_index().contains(bo.get_locs())
     model_locs_in_brain = _count_overlapping(bo.get_locs(), mo.get_locs())
 
     if np.all(model_locs_in_brain):
         #if the model contains all of the locations (or fewer) than what are in the brain object, no reconstructions
         #are needed
-        return data[:, brain_locs_in_model]
+        if target_inds is None:
+            return data[:, brain_locs_in_model], None, None, None, None, None
+        target_locs = np.round(mo.get_locs().as_matrix()[target_inds, :], 3)
+        data_inds = _LocationIndex(bo.get_locs(), decimals=3).rows(target_locs)
+        return data[:, data_inds], None, None, None, None, None
 
     #otherwise, we'll need to do some work
-    Z = mo.get_model(z_transform=True)
+    known_inds, unknown_inds = known_unknown(mo.get_locs().as_matrix(), bo.get_locs().as_matrix(),
+                                             bo.get_locs().as_matrix(), index=mo._location_index(decimals=3))
+
+    if target_inds is None:
+        obs_src, obs_dst, rec_dst, n_out = list(range(len(known_inds))), known_inds, unknown_inds, \
+                                           len(known_inds) + len(unknown_inds)
+    else:
+        #only reconstruct the unobserved target locations
+        target_cols = dict((t, i) for i, t in enumerate(target_inds))
+        unknown_inds = [u for u in unknown_inds if u in target_cols]
+        obs_src = [i for i, k in enumerate(known_inds) if k in target_cols]
+        obs_dst = [target_cols[known_inds[i]] for i in obs_src]
+        rec_dst = [target_cols[u] for u in unknown_inds]
+        n_out = len(target_inds)
+
     if ~np.any(brain_locs_in_model):
         #if none of the brain locations are in the model, we need to blur out the model to match up with the
         # locations in the brain object
         ### isnt this bypassed in the set_locs??
+        Z = mo.get_model(z_transform=True)
         combined_locs = np.vstack((bo.get_locs(), mo.get_locs()))
         model_locs_in_brain = [False]*bo.get_locs().shape[0]
         model_locs_in_brain.extend([True]*mo.get_locs().shape[0])
@@ -560,30 +1148,88 @@ def _timeseries_recon(bo, mo, chunk_size=1000, preprocess='zscore'):
         rbf_weights = _log_rbf(combined_locs, mo.get_locs())
         Z = _blur_corrmat(Z, rbf_weights)
 
-    K = _z2r(Z)
+        K = _z2r(Z)
+        Kaa = K[known_inds, :][:, known_inds]
+        Kba = K[unknown_inds, :][:, known_inds]
+        projection = _solve_projection(Kaa, Kba, solver=solver, ridge=ridge)
+    else:
+        #the projection operator only depends on the model and on which of its locations are observed, so it is
+        #cached by the model
+        projection = mo._get_projection(known_inds, unknown_inds, solver=solver, ridge=ridge)
 
-    known_inds, unknown_inds = known_unknown(mo.get_locs().as_matrix(), bo.get_locs().as_matrix(),
-                                             bo.get_locs().as_matrix())
+    return data, projection, obs_src, obs_dst, rec_dst, n_out
 
-    Kaa = K[known_inds, :][:, known_inds]
-    Kaa_inv = np.linalg.pinv(Kaa)
 
-    Kba = K[unknown_inds, :][:, known_inds]
+def _timeseries_recon_chunks(bo, mo, chunk_size=1000, preprocess='zscore', solver='pinv', ridge=0., target_inds=None):
+    """
+    Generator version of _timeseries_recon that reconstructs one chunk (of at most chunk_size samples from a single
+    session) at a time.  Each session's reconstructions are z-scored using that session's mean and covariance of the
+    observed data (the reconstructions are linear in the observed data), so the results are identical to those
+    of _timeseries_recon, but only one chunk of reconstructed data is held in memory at a time.
 
-    sessions = bo.sessions.unique()
-    try_filter = []
-    chunks = [np.array(i) for session in sessions for i in _chunker(bo.sessions[bo.sessions == session].index.tolist(), chunk_size)]
-    for i in chunks:
-        try_filter.append([x for x in i if x is not None])
-    #predict unobserved brain activitity
-    combined_data = np.zeros((data.shape[0], K.shape[0]), dtype=data.dtype)
-    combined_data[:, unknown_inds] = np.vstack(list(map(lambda x: _reconstruct_activity(data[x, :], Kba, Kaa_inv), try_filter)))
-    combined_data[:, known_inds] = data
+    Parameters
+    ----------
+    bo : Brain object
+        Data to be reconstructed
 
-    for s in sessions:
-        combined_data[bo.sessions==s, :] = zscore(combined_data[bo.sessions==s, :])
+    mo : Model object
+        Model to base the reconstructions on
+
+    chunk_size : int
+        Maximum number of samples per chunk
+
+    preprocess : 'zscore' or None
+        See _timeseries_recon
+
+    solver : 'pinv' or 'cholesky'
+        See _timeseries_recon
+
+    ridge : float
+        See _timeseries_recon
+
+    target_inds : list or None
+        See _timeseries_recon
+
+    Yields
+    ----------
+    sample_inds : ndarray
+        Indices of the samples in the chunk
+
+    results : ndarray
+        Reconstructed timeseries for the chunk (samples x model, or target, locations)
+    """
+    data, projection, obs_src, obs_dst, rec_dst, n_out = _recon_operator(bo, mo, preprocess=preprocess,
+                                                                         solver=solver, ridge=ridge,
+                                                                         target_inds=target_inds)
+    sessions = np.asarray(bo.sessions)
+
+    for session in pd.unique(sessions):
+        inds = np.where(sessions == session)[0]
+        if projection is None:
+            for start in range(0, len(inds), chunk_size):
+                yield inds[start:start + chunk_size], data[inds[start:start + chunk_size], :]
+            continue
+
+        #per-session statistics of the observed data determine the statistics of the reconstructions
+        Y = data[inds, :]
+        mean = np.mean(Y, axis=0)
+        cov = np.atleast_2d(np.cov(Y, rowvar=False, bias=True))
+
+        means = np.zeros(n_out)
+        stds = np.zeros(n_out)
+        means[obs_dst] = mean[obs_src]
+        stds[obs_dst] = np.sqrt(np.diag(cov))[obs_src]
+        means[rec_dst] = np.dot(projection, mean)
+        stds[rec_dst] = np.sqrt(np.maximum(np.sum(np.dot(projection, cov) * projection, axis=1), 0))
+
+        for start in range(0, len(inds), chunk_size):
+            chunk = np.zeros((min(chunk_size, len(inds) - start), n_out), dtype=data.dtype)
+            chunk[:, rec_dst] = _reconstruct_activity(Y[start:start + chunk_size, :], projection)
+            chunk[:, obs_dst] = Y[start:start + chunk_size, obs_src]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                chunk = np.divide(chunk - means, stds)
+            yield inds[start:start + chunk_size], chunk
 
-    return combined_data
 
 def _chunker(iterable, chunksize, fillvalue=None):
     """
@@ -612,7 +1258,52 @@ def _chunker(iterable, chunksize, fillvalue=None):
     return list(zip_longest(*args, fillvalue=fillvalue))
 
 
-def _reconstruct_activity(Y, Kba, Kaa_inv):
+def _solve_projection(Kaa, Kba, solver='pinv', ridge=0.):
+    """
+    Computes the projection operator Kba * (Kaa + ridge * I)^-1
+
+    Parameters
+    ----------
+    Kaa : numpy array
+        correlation matrix (known to known)
+
+    Kba : numpy array
+        correlation matrix (unknown to known)
+
+    solver : 'pinv' or 'cholesky'
+        'pinv' (default) uses the (SVD-based) pseudo-inverse.  'cholesky' solves the (symmetric) system using a
+        Cholesky factorization, falling back on an eigendecomposition (discarding near-zero and negative eigenvalues)
+        if the regularized matrix is not positive definite.
+
+    ridge : float
+        Regularization added to the diagonal of Kaa (default: 0)
+
+    Returns
+    ----------
+    projection : numpy array
+        unknown x known projection operator
+
+    """
+    Kaa = np.asarray(Kaa, dtype=np.float64)
+    if ridge > 0:
+        Kaa = Kaa + ridge * np.eye(Kaa.shape[0])
+
+    if solver == 'pinv':
+        return np.dot(Kba, np.linalg.pinv(Kaa))
+    elif solver == 'cholesky':
+        try:
+            factor = linalg.cho_factor(Kaa, lower=True, check_finite=False)
+            return linalg.cho_solve(factor, np.asarray(Kba).T, check_finite=False).T
+        except linalg.LinAlgError:
+            vals, vecs = linalg.eigh(Kaa, check_finite=False)
+            keep = vals > np.max(np.abs(vals)) * Kaa.shape[0] * np.finfo(vals.dtype).eps
+            vecs = vecs[:, keep]
+            return np.dot(np.dot(Kba, vecs) / vals[keep], vecs.T)
+    else:
+        raise ValueError('Unsupported solver: ' + str(solver))
+
+
+def _reconstruct_activity(Y, projection):
     """
     Reconstruct activity
 
@@ -621,9 +1312,9 @@ def _reconstruct_activity(Y, Kba, Kaa_inv):
     Y : numpy array
         brain object with zscored data
 
-    Kba : correlation matrix (unknown to known)
-
-    Kaa_inv : inverse correlation matrix (known to known)
+    projection : numpy array
+        projection operator (Kba * Kaa^-1) from known to unknown locations, where Kba is the correlation matrix
+        (unknown to known) and Kaa is the correlation matrix (known to known)
 
     zscore = False
 
@@ -633,7 +1324,7 @@ def _reconstruct_activity(Y, Kba, Kaa_inv):
         Reconstructed timeseries
 
     """
-    return np.dot(np.dot(Kba, Kaa_inv), Y.T).T
+    return np.dot(Y, projection.T)
 
 
 def filter_elecs(bo, measure='kurtosis', threshold=10):
@@ -758,14 +1449,39 @@ def _fullfact(dims):
         return inds
 
 
-def model_compile(data):
+def model_compile(data, locs=None, template=None, rbf_width=20, rbf_cutoff=None, checkpoint=None,
+                  checkpoint_every=10):
     """
     Compile existing expanded correlation matrices.
 
+    Files are streamed from disk one at a time, so only the running (log) numerator and denominator are held in
+    memory.  If a checkpoint file is given, the partially compiled model is periodically saved to it (along with the
+    list of files that have been compiled so far, stored in meta['compiled_files']).  If the checkpoint file already
+    exists, compiling resumes from it and files that were already compiled are skipped.
+
     Parameters
     ----------
-    data : list of model object file directories
-        Compiles model objects
+    data : str or list
+        Directory containing .mo and/or .bo files (other than the checkpoint file), the path of a single file, or a
+        list of file paths (or Model/Brain/Nifti objects).  Model objects are copied rather than modified.
+
+    locs : pandas DataFrame or numpy array
+        Locations to blur each brain object out to (default: None, use the union of all locations)
+
+    template : Nifti object or str
+        Template to blur each brain object out to (default: None)
+
+    rbf_width : int or float
+        Width of the radial basis function used to blur brain objects (default: 20)
+
+    rbf_cutoff : int or float
+        Truncation radius of the radial basis function, in units of rbf_width (default: None)
+
+    checkpoint : str
+        Path to the checkpoint (.mo) file (default: None; no checkpointing)
+
+    checkpoint_every : int
+        Number of files to compile between checkpoints (default: 10)
 
     Returns
     ----------
@@ -774,13 +1490,79 @@ def model_compile(data):
 
     """
     from .load import load
+    from .model import Model
+
+    if not (checkpoint is None) and checkpoint[-3:] != '.mo':
+        checkpoint += '.mo'
+
+    if isinstance(data, six.string_types):
+        if os.path.isdir(data):
+            data = sorted(glob.glob(os.path.join(data, '*.mo')) + glob.glob(os.path.join(data, '*.bo')))
+            if not (checkpoint is None):
+                #the checkpoint (and its temporary file) may be saved in the data directory
+                exclude = [os.path.abspath(checkpoint), os.path.abspath(checkpoint[:-3] + '.tmp.mo')]
+                data = [d for d in data if not (os.path.abspath(d) in exclude)]
+        else:
+            data = [data]
+    assert len(data) > 0, 'no data to compile'
+
+    m = None
+    compiled = []
+    if not (checkpoint is None) and os.path.exists(checkpoint):
+        m = load(checkpoint)
+        compiled = list(m.meta.pop('compiled_files', []))
+
+    def _key(d):
+        if isinstance(d, six.string_types):
+            return os.path.abspath(d)
+        return None
+
+    since_checkpoint = 0
+    for d in data:
+        key = _key(d)
+        if not (key is None) and key in compiled:
+            continue
+
+        if isinstance(d, six.string_types):
+            d = load(d)
+        elif (m is None) and isinstance(d, Model):
+            d = Model(d) #don't modify the caller's model
+        if not isinstance(d, Model):
+            d = Model(data=d, locs=locs, template=template, rbf_width=rbf_width, rbf_cutoff=rbf_cutoff)
+
+        if m is None:
+            m = d
+        else:
+            m.update(d)
+        del d
+
+        if not (key is None):
+            compiled.append(key)
+        since_checkpoint += 1
 
-    m = load(data[0])
-    m.update(data[1:])
+        if not (checkpoint is None) and since_checkpoint >= checkpoint_every:
+            _save_checkpoint(m, compiled, checkpoint)
+            since_checkpoint = 0
+
+    if not (checkpoint is None) and since_checkpoint > 0:
+        _save_checkpoint(m, compiled, checkpoint)
     return m
 
 
-def _near_neighbor(bo, mo, match_threshold='auto'): #TODO: should this be part of bo.get_locs() or Brain.__init__, or possibly model.__init__?
+def _save_checkpoint(model, compiled, fname):
+    """
+    Atomically saves a partially compiled model, along with the list of compiled files, to fname
+    """
+    tmp_fname = fname[:-3] + '.tmp.mo'
+    model.meta['compiled_files'] = compiled
+    try:
+        model.save(tmp_fname)
+    finally:
+        model.meta.pop('compiled_files')
+    os.rename(tmp_fname, fname)
+
+
+def _near_neighbor(bo, mo, match_threshold='auto', assignment='greedy'): #TODO: should this be part of bo.get_locs() or Brain.__init__, or possibly model.__init__?
     """
     Finds the nearest voxel for each subject's electrode location and uses
     that as revised electrodes location matrix in the prediction.
@@ -807,35 +1589,78 @@ def _near_neighbor(bo, mo, match_threshold='auto'): #TODO: should this be part o
 
         match_threshold > 0 : include only nearest neighbor that are within given distance
 
+    assignment : 'greedy' or 'optimal'
+        How electrodes are matched to (distinct) voxels.  'greedy' (default) repeatedly matches the closest
+        remaining electrode and voxel.  'optimal' minimizes the total distance between the electrodes and their
+        matched voxels (using the Hungarian algorithm).
+
     Returns
     ----------
     bo : Brain object
         A new updated brain object
 
     """
-
-    nbo = copy.deepcopy(bo) #FIXME: copying is expensive...
-    nbo.orig_locs = nbo.locs
-    d = cdist(nbo.locs, mo.locs, metric='Euclidean')
-    for i in range(len(nbo.locs)):
-        min_ind = list(zip(*np.where(d == d.min())))[0]
-        nbo.locs.iloc[min_ind[0], :] = mo.locs.iloc[min_ind[1], :]
-        d[min_ind[0]] = np.inf
-        d[:, min_ind[1]] = np.inf
-    if not match_threshold is 0 or None:
-
-        if match_threshold is 'auto':
+    locs = bo.locs.as_matrix().astype(np.float64)
+    model_locs = mo.locs.as_matrix().astype(np.float64)
+
+    #each electrode is matched to one of its n_elecs nearest voxels (the other electrodes can claim at most
+    #n_elecs - 1 of them), so only those candidates need to be considered
+    k = min(locs.shape[0], model_locs.shape[0])
+    matched = np.arange(locs.shape[0])
+    voxels = np.zeros(0, dtype=np.int64)
+    if k > 0:
+        tmp, candidates = cKDTree(model_locs).query(locs, k=k)
+        candidates = np.reshape(candidates, [locs.shape[0], k])
+        elecs = np.repeat(np.arange(locs.shape[0]), k)
+        candidates = candidates.ravel()
+        dists = np.sqrt(np.sum((locs[elecs, :] - model_locs[candidates, :]) ** 2, axis=1))
+
+        if assignment == 'optimal':
+            cols, col_inds = np.unique(candidates, return_inverse=True)
+            cost = np.full([locs.shape[0], len(cols)], np.inf)
+            cost[elecs, col_inds] = dists
+            matched, voxels = linear_sum_assignment(cost)
+            voxels = cols[voxels]
+        else:
+            assert assignment == 'greedy', 'assignment must be \'greedy\' or \'optimal\''
+            #process candidate pairs from closest to furthest (ties are broken by electrode, then voxel, index)
+            order = np.lexsort((candidates, elecs, dists))
+            elec_done = np.zeros(locs.shape[0], dtype=bool)
+            voxel_done = {}
+            matched, voxels = [], []
+            for e, v in zip(elecs[order], candidates[order]):
+                if elec_done[e] or (v in voxel_done):
+                    continue
+                elec_done[e] = True
+                voxel_done[v] = True
+                matched.append(e)
+                voxels.append(v)
+                if len(matched) == k:
+                    break
+
+    new_locs = locs.copy()
+    new_locs[matched, :] = model_locs[voxels, :]
+
+    #copy the brain object without copying its data (but with its own cache of filtered data and locations)
+    nbo = copy.copy(bo)
+    nbo._filtered = {}
+    nbo.orig_locs = bo.locs
+    nbo.locs = pd.DataFrame(new_locs, columns=bo.locs.columns, index=bo.locs.index)
+
+    if not ((match_threshold is None) or (match_threshold == 0)):
+        if match_threshold == 'auto':
             v_size = _vox_size(mo.locs)
-            thresh_bool = abs(nbo.locs - bo.locs) > v_size
+            thresh_bool = abs(new_locs - locs) > v_size
             thresh_bool = thresh_bool.any(1).ravel()
         else:
-            thresh_bool = abs(nbo.locs - bo.locs) > match_threshold
+            thresh_bool = abs(new_locs - locs) > match_threshold
             thresh_bool = thresh_bool.any(1).ravel()
             assert match_threshold > 0, 'Negative Euclidean distances are not allowed'
+        kurtosis = bo.kurtosis #computed from all of the electrodes, before any are removed
         nbo.data = nbo.data.loc[:, ~thresh_bool]
         nbo.locs = nbo.locs.loc[~thresh_bool, :]
         nbo.n_elecs = nbo.data.shape[1]
-        nbo.kurtosis = nbo.kurtosis[~thresh_bool]
+        nbo.kurtosis = kurtosis[~thresh_bool]
         return nbo
     else:
         return nbo
@@ -982,20 +1807,10 @@ def get_rows(all_locations, subj_locations):
         """
     if subj_locations.ndim == 1:
         subj_locations = subj_locations.reshape(1, 3)
-    inds = np.full([1, subj_locations.shape[0]], np.nan)
-    for i in range(subj_locations.shape[0]):
-        possible_locations = np.ones([all_locations.shape[0], 1])
-        try:
-            for c in range(all_locations.shape[1]):
-                possible_locations[all_locations[:, c] != subj_locations[i, c], :] = 0
-            inds[0, i] = np.where(possible_locations == 1)[0][0]
-        except:
-            pass
-    inds = inds[~np.isnan(inds)]
-    return [int(x) for x in inds]
+    return _LocationIndex(all_locations).rows(subj_locations)
 
 
-def known_unknown(fullarray, knownarray, subarray=None, electrode=None):
+def known_unknown(fullarray, knownarray, subarray=None, electrode=None, index=None):
     """
         This finds the indices for known and unknown electrodes in the full array of electrode locations
 
@@ -1013,6 +1828,10 @@ def known_unknown(fullarray, knownarray, subarray=None, electrode=None):
         electrode : str
             Index of electrode in subarray to remove (in the leave one out case)
 
+        index : _LocationIndex or None
+            Index of the locations in fullarray (rounded to 3 decimals), e.g. cached by a model.  If None (default),
+            the index is built from fullarray.
+
         Returns
         ----------
         known_inds : list
@@ -1022,13 +1841,15 @@ def known_unknown(fullarray, knownarray, subarray=None, electrode=None):
             List of unknown indices
 
         """
+    if index is None:
+        index = _LocationIndex(fullarray, decimals=3)
     ## where known electrodes are located in full matrix
-    known_inds = get_rows(np.round(fullarray, 3), np.round(knownarray, 3))
+    known_inds = index.rows(knownarray)
     ## where the rest of the electrodes are located
-    unknown_inds = list(set(range(np.shape(fullarray)[0])) - set(known_inds))
+    unknown_inds = index.complement(known_inds)
     if not electrode is None:
         ## where the removed electrode is located in full matrix
-        rm_full_ind = get_rows(np.round(fullarray, 3), np.round(subarray[int(electrode)], 3))
+        rm_full_ind = index.rows(subarray[int(electrode)])
         ## where the removed electrode is located in the unknown index subset
         rm_unknown_ind = np.where(np.array(unknown_inds) == np.array(rm_full_ind))[0].tolist()
         return known_inds, unknown_inds, rm_unknown_ind
@@ -1053,7 +1874,105 @@ def _count_overlapping(X, Y):
         Array of length Y.shape[0] with 0s and 1s, where 1s denote rows in Y that are also in X
     """
 
-    return np.sum([(Y == x).all(1) for idx, x in X.iterrows()], 0).astype(bool)
+    return _match_locs(X, Y) >= 0
+
+
+def _loc_keys(X, decimals=None):
+    """
+    Packs each row of a matrix of locations into a single sortable (and hashable) key
+
+    Parameters
+    ----------
+    X : Numpy array or pandas dataframe with electrode locations
+
+    decimals : int or None
+        If None (default), locations only share a key if all of their coordinates are exactly equal.  Otherwise
+        coordinates are rounded to the given number of decimals (i.e. locations whose coordinates round to the same
+        values share a key).
+
+    Returns
+    ----------
+    keys : Numpy array
+        Array of length X.shape[0] with one key per location
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if decimals is None:
+        keys = np.ascontiguousarray(X + 0.).view(np.int64) #adding 0 maps -0 onto 0
+    else:
+        keys = np.ascontiguousarray(np.round(X * 10 ** decimals).astype(np.int64))
+    return keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+
+def _match_locs(X, Y, decimals=None):
+    """
+    Finds the index of each location in Y within X, by sorting and binary-searching packed location keys
+
+    Parameters
+    ----------
+    X : Numpy array or pandas dataframe of reference locations
+
+    Y : Numpy array or pandas dataframe of to-be-matched locations
+
+    decimals : int or None
+        See _loc_keys.  (Default: None, locations must match exactly)
+
+    Returns
+    ----------
+    results : ndarray
+        Array of length Y.shape[0] with the (first) matching row of X for each row of Y, or -1 for rows of Y that
+        are not in X
+    """
+    return _LocationIndex(X, decimals=decimals).find(Y)
+
+
+class _LocationIndex(object):
+    """
+    Sorted index of a set of locations that supports vectorized lookups of (sets of) locations
+
+    Parameters
+    ----------
+    locs : Numpy array or pandas dataframe with electrode locations
+
+    decimals : int or None
+        See _loc_keys.  (Default: None, locations must match exactly)
+    """
+    def __init__(self, locs, decimals=None):
+        self.decimals = decimals
+        self.n = np.shape(locs)[0]
+        keys = _loc_keys(locs, decimals=decimals) if self.n > 0 else np.array([])
+        self.order = np.argsort(keys, kind='mergesort') #stable, so that the first of any duplicate locations is found
+        self.keys = keys[self.order]
+
+    def find(self, locs):
+        """
+        Returns the (first) index of each of the given locations, or -1 for locations that are not in the index
+        """
+        keys = _loc_keys(locs, decimals=self.decimals)
+        if self.n == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), self.n - 1)
+        return np.where(self.keys[pos] == keys, self.order[pos], -1)
+
+    def contains(self, locs):
+        """
+        Returns a boolean array denoting which of the given locations are in the index
+        """
+        return self.find(locs) >= 0
+
+    def rows(self, locs):
+        """
+        Returns a list of the indices of the given locations (locations that are not in the index are skipped)
+        """
+        inds = self.find(locs)
+        return [int(x) for x in inds[inds >= 0]]
+
+    def complement(self, inds):
+        """
+        Returns a (sorted) list of the indices that are not in inds
+        """
+        return np.setdiff1d(np.arange(self.n), np.asarray(inds, dtype=np.int64)).tolist()
 
 
 def make_gif_pngs(nifti, gif_path, index=range(100, 200), name=None, **kwargs):
@@ -1101,47 +2020,6 @@ def make_gif_pngs(nifti, gif_path, index=range(100, 200), name=None, **kwargs):
     imageio.mimsave(gif_outfile, images)
 
 
-def _data_and_samplerate_by_file_index(bo, xform, **kwargs):
-    """
-    Session dependent function application and aggregation
-
-    Parameters
-    ----------
-    bo : Brain object
-        Contains data
-
-    xform : function
-        The function to apply to the data matrix from each filename
-
-    aggregator: function
-        Function for aggregating results across multiple iterations
-
-    Returns
-    ----------
-    results : numpy ndarray
-         Array of aggregated results
-
-    """
-    sample_rate = []
-
-    for idx, session in enumerate(bo.sessions.unique()):
-        if idx is 0:
-            data_results, session_results, sr_results = xform(bo.data.loc[bo.sessions == session],
-                                                                       bo.sessions.loc[bo.sessions == session],
-                                                                       bo.sample_rate[idx], **kwargs)
-            sample_rate.append(sr_results)
-        else:
-            data_next, session_next, sr_next = xform(bo.data.loc[bo.sessions == session, :],
-                                                                           bo.sessions.loc[bo.sessions == session],
-                                                                           bo.sample_rate[idx], **kwargs)
-            data_results = data_results.append(data_next, ignore_index=True)
-            session_results = session_results.append(session_next, ignore_index=True)
-            sample_rate.append(sr_next)
-
-    return data_results, session_results, sample_rate
-
-
-
 def _resample(bo, resample_rate=64):
     """
     Function that resamples data to specified sample rate
@@ -1159,27 +2037,20 @@ def _resample(bo, resample_rate=64):
         Resample rate - List
 
     """
+    groups = bo.groupby('session', filtered=False)
 
+    #each session's resampled data is given by evenly spaced samples (rounded to the nearest sample), so all of the
+    #resampled rows can be taken from the data at once
+    samples = np.arange(groups.data.shape[0])
+    rows = []
+    for (session, inds), sample_rate in zip(groups.groups, groups.sample_rates()):
+        session_samples = samples[inds]
+        n_samples = int(np.round(len(session_samples) * resample_rate / sample_rate))
+        rows.append(session_samples[np.round(np.linspace(0, len(session_samples) - 1, n_samples)).astype(np.int64)])
+    rows = np.concatenate(rows)
 
-    def _resamp(data, session, sample_rate, resample_rate):
-
-        # number of samples for resample
-        n_samples = np.round(np.shape(data)[0] * resample_rate / sample_rate)
-
-        # index for those samples
-        resample_index = np.round(np.linspace(data.index.min(), data.index.max(), n_samples))
-
-        # resampled sessions
-        re_session = session[resample_index]
-        re_session.interpolate(method='pchip', inplace=True, limit_direction='both')
-
-        # resampled data
-        re_data = data.loc[resample_index]
-        re_data.interpolate(method='pchip', inplace=True, limit_direction='both')
-
-        return re_data, re_session, resample_rate
-
-    return _data_and_samplerate_by_file_index(bo, _resamp, resample_rate=resample_rate)
+    return pd.DataFrame(groups.data[rows], columns=bo.data.columns), pd.Series(bo.sessions.values[rows]), \
+           [resample_rate] * len(groups)
 
 
 def _plot_locs_connectome(locs, label=None, pdfpath=None):
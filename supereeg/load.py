@@ -266,6 +266,10 @@ def _load_slice(fname, sample_inds=None, loc_inds=None):
     sr = dd.io.load(fname, group='/sample_rate') #FIXME: use os.path.join rather than using slashes
     meta = dd.io.load(fname, group='/meta') #FIXME: use os.path.join rather than using slashes
     date_created = dd.io.load(fname, group='/date_created') #FIXME: use os.path.join rather than using slashes
+    try:
+        dtype = dd.io.load(fname, group='/dtype') #FIXME: use os.path.join rather than using slashes
+    except ValueError: #saved before brain objects stored their dtype
+        dtype = None
 
     if sample_inds!=None and loc_inds!=None:
         if not isinstance(sample_inds, int) and not isinstance(loc_inds, int):
@@ -288,4 +292,4 @@ def _load_slice(fname, sample_inds=None, loc_inds=None):
         if data.shape[1]>data.shape[0]:
             data = data.T
     return dict(data=data, locs=locs,
-                sample_rate=sample_rate, meta=meta, date_created=date_created)
+                sample_rate=sample_rate, meta=meta, date_created=date_created, dtype=dtype)
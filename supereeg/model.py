@@ -1,19 +1,25 @@
 from __future__ import division
 from __future__ import print_function
+import os
 import time
 import copy
 import warnings
 import six
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import seaborn as sns
 import deepdish as dd
 import matplotlib.pyplot as plt
-from .helpers import _get_corrmat, _r2z, _z2r, _log_rbf, _blur_corrmat, _plot_borderless,\
-    _near_neighbor, _timeseries_recon, _count_overlapping, _plot_locs_connectome, \
+from joblib import Parallel, delayed, effective_n_jobs
+from .helpers import _get_corrmat, _r2z, _z2r, _log_rbf, _blur_corrmat, _expand_corrmat, _blur_added, \
+    _plot_borderless, _near_neighbor, _timeseries_recon, _count_overlapping, _plot_locs_connectome, \
     _plot_locs_hyp, _gray, _nifti_to_brain,\
-    _unique, _union, _empty, _to_log_complex, _to_exp_real
+    _unique, _union, _empty, _to_log_complex, _to_exp_real, _triu_index, _triu_size, _pack_triu, _unpack_triu, \
+    _to_log_planes, _from_log_planes, _simplify_log_planes, _solve_projection, _timeseries_recon_chunks, \
+    _LocationIndex, _dense_log_weights
 from .brain import Brain
+from .accumulator import CorrelationAccumulator
 from .nifti import Nifti
 
 
@@ -33,6 +39,7 @@ class Model(object):
     ----------
     data : supereeg.Brain or list supereeg.Brain, supereeg.Nifti or list supereeg.Nifti, or Numpy.ndarray
         A supereeg.Brain object or supereeg.Nifti object,  list of objects, or a Numpy.ndarray of your model.
+        A supereeg.CorrelationAccumulator may be passed in place of a brain object.
     locs : pandas.DataFrame or np.ndarray
         MNI coordinate (x,y,z) by number of electrode df containing electrode locations
     template : filepath
@@ -41,18 +48,40 @@ class Model(object):
         (Optional) A locations x locations matrix comprising the sum of the log z-transformed
         correlation matrices over subjects.  If used, must also pass denominator,
         locs and n_subs. Otherwise, numerator will be computed from the brain
-        object data.
+        object data.  A 1D array is interpreted as a packed upper triangle (see
+        packed).
     denominator : Numpy.ndarray
         (Optional) A locations x locations matrix comprising the sum of the log (weighted) number of
         subjects contributing to each matrix cell. If used, must also pass numerator,
         locs and n_subs. Otherwise, denominator will be computed from the brain
-        object data.
+        object data.  A 1D array is interpreted as a packed upper triangle (see
+        packed).
     n_subs : int
         The number of subjects used to create the model.  Required if you pass
         numerator/denominator.  Otherwise computed automatically from the data.
+    factors : list of (locations, Numpy.ndarray) tuples
+        (Optional) A list of per-subject factors, each comprising the subject's
+        locations and Fisher z-transformed correlation matrix.  If used, must
+        also pass locs and n_subs.  The numerator and denominator are computed
+        from the factors when they are needed.
+    factorize : bool
+        If True, keep the model in factorized form: each subject contributes
+        its (small) locations and z-transformed correlation matrix, and the
+        full locations x locations numerator and denominator are only
+        computed (and cached) when they are accessed.  Restricting the model
+        to a subset of its locations re-blurs each subject's data directly
+        onto the remaining locations; adding locations blurs the combined
+        model (so that the results match a model that is not factorized),
+        after which the model is no longer factorized.  (Default: False)
     rbf_width : positive scalar
         The width of the radial basis function (RBF) used as a spatial prior for
         smoothing estimates at nearby locations.  (Default: 20)
+    rbf_cutoff : positive scalar or None
+        If specified, the RBF is truncated: locations that are more than
+        rbf_cutoff * rbf_width apart are given zero weight, and the blurred
+        model is only computed for locations near at least one observed
+        location (all other entries carry no information).  If None, the full
+        RBF is used.  (Default: None)
     meta : dict
         Dict containing whatever you want:
         Initialized with a stability field {'stable':True}. This is changed
@@ -61,6 +90,37 @@ class Model(object):
         Time created
     save : None
         Optional filename to save created model
+    n_jobs : int
+        Number of parallel jobs used to build a model from a list of data
+        objects (-1 uses all available cores).  When n_jobs is not 1, the
+        subjects are split into batches that are blurred out to the model
+        locations concurrently, and the per-batch numerators and denominators
+        are then combined pairwise.  If locs is not given, the model locations
+        are the union of the locations of all the data objects.  Ignored for
+        factorized models.  (Default: 1)
+    packed : bool
+        If True, only the upper triangles (including the diagonals) of the
+        (symmetric) numerator and denominator are stored, as 1D arrays.  The
+        numerator and denominator attributes are expanded to full matrices
+        when they are accessed; get_rows and get_slice read the packed
+        triangles directly, and update combines them without expanding them.
+        (Default: False)
+    dtype : numpy float dtype or None
+        If specified (e.g. np.float32), the numerator is stored as two
+        separate real log planes of the given dtype (the log of the positive
+        parts and the log of the negative parts, stacked along a new first
+        dimension) rather than as a single complex128 matrix, and the
+        denominator is stored using the same dtype.  update then combines and
+        simplifies the planes in place.  A real-valued numerator passed in
+        along with dtype is interpreted as a stack of log planes.  If None,
+        the complex encoding is used.  (Default: None)
+    projection_cache_size : int
+        Maximum number of projection operators (one per set of observed
+        locations) that predict caches, so that repeated predictions for the
+        same electrode montage reuse the inverted correlation matrix.  The
+        same number of blurred views of the model (one per set of locations
+        that are not in the model) is cached as well.  The caches are cleared
+        whenever the model or its locations change.  (Default: 8)
 
     Attributes
     ----------
@@ -72,6 +132,15 @@ class Model(object):
         subjects contributing to each matrix cell
     n_subs : int
         Number of subject used to create the model
+    factors : list of (Numpy.ndarray, Numpy.ndarray) tuples or None
+        Per-subject locations and z-transformed correlation matrices (only for
+        factorized models)
+    packed : bool
+        Whether the numerator and denominator are stored as packed upper
+        triangles
+    dtype : numpy dtype or None
+        The dtype of the numerator log planes and denominator (None if the
+        numerator is stored as complex numbers)
 
     Returns
     ----------
@@ -80,12 +149,28 @@ class Model(object):
     """
     def __init__(self, data=None, locs=None, template=None,
                  numerator=None, denominator=None,
-                 n_subs=None, meta=None, date_created=None, rbf_width=20, save=None):
+                 n_subs=None, meta=None, date_created=None, rbf_width=20, rbf_cutoff=None, save=None,
+                 factors=None, factorize=False, n_jobs=1, packed=False, dtype=None, projection_cache_size=8):
         from .load import load
 
+        if isinstance(numerator, six.string_types): #memory-mapped numerator (see Model.save)
+            numerator = np.load(numerator, mmap_mode='r')
+        if isinstance(denominator, six.string_types): #memory-mapped denominator (see Model.save)
+            denominator = np.load(denominator, mmap_mode='r')
+
+        if not (dtype is None):
+            dtype = np.dtype(dtype)
+            assert dtype.kind == 'f', 'dtype must be a real floating point type'
+        self.dtype = dtype
+        planes = _is_planes(numerator, dtype)
+        self.packed = packed or ((not (numerator is None)) and (np.ndim(numerator) - int(planes) == 1))
+        self.projection_cache_size = projection_cache_size
+        self._projections = OrderedDict()
+        self._views = OrderedDict()
         self.locs = None
         self.numerator = None
         self.denominator = None
+        self._factors = None
         self.n_subs = 0
         self.meta = meta
         if self.meta is None:
@@ -93,6 +178,7 @@ class Model(object):
         self.date_created = date_created
         #self.rbf_width = float(rbf_width)
         self.rbf_width = rbf_width
+        self.rbf_cutoff = rbf_cutoff
 
         if n_subs is None:
             n_subs = 1
@@ -117,12 +203,36 @@ class Model(object):
                                 all_locs = np.vstack((all_locs, data[i].get_locs().as_matrix()))
                     locs, loc_inds = _unique(all_locs)
 
-                    self.__init__(data=data[0], locs=locs, template=template, meta=self.meta, rbf_width=self.rbf_width,
-                                  n_subs=1)
-
-                    for i in range(1, len(data)):
-                        self.update(Model(data=data[i], locs=locs, template=template, meta=self.meta,
-                                          rbf_width=self.rbf_width, n_subs=1))
+                    if (n_jobs == 1) or factorize or (len(data) == 1):
+                        self.__init__(data=data[0], locs=locs, template=template, meta=self.meta,
+                                      rbf_width=self.rbf_width, rbf_cutoff=self.rbf_cutoff, n_subs=1,
+                                      factorize=factorize, packed=self.packed, dtype=self.dtype,
+                                      projection_cache_size=projection_cache_size)
+
+                        for i in range(1, len(data)):
+                            self.update(Model(data=data[i], locs=locs, template=template, meta=self.meta,
+                                              rbf_width=self.rbf_width, rbf_cutoff=self.rbf_cutoff, n_subs=1,
+                                              factorize=factorize, packed=self.packed, dtype=self.dtype))
+                    else:
+                        if (locs is None) and (template is None):
+                            locs = _unique(np.vstack([_data_locs(d) for d in data]))[0]
+
+                        n_batches = min(len(data), effective_n_jobs(n_jobs))
+                        batches = [data[i::n_batches] for i in range(n_batches)]
+                        partials = Parallel(n_jobs=n_jobs)(delayed(_build_partial)(b, locs, template, self.rbf_width,
+                                                                                    self.rbf_cutoff) for b in batches)
+
+                        #pairwise (tree) reduction of the per-batch numerators and denominators
+                        while len(partials) > 1:
+                            partials = [_combine_partials(*partials[i:i + 2]) for i in range(0, len(partials), 2)]
+                        part_num, part_den, part_n_subs, part_locs, part_meta = partials[0]
+
+                        self.numerator = _to_log_complex(_to_exp_real(part_num))
+                        self.denominator = part_den
+                        self.locs = part_locs
+                        self.n_subs = part_n_subs
+                        if type(part_meta) == dict:
+                            self.meta.update(part_meta)
 
             if isinstance(data, six.string_types):
                 data = load(data)
@@ -132,17 +242,39 @@ class Model(object):
 
             if isinstance(data, Model):
                 self.date_created = data.date_created
-                self.denominator = data.denominator
+                self.packed = self.packed or data.packed
+                if self.dtype is None:
+                    self.dtype = data.dtype
+                if self._storage_format() == data._storage_format():
+                    self._numerator = data._numerator
+                    self._denominator = data._denominator
+                    if self._planes: #log planes are updated in place, so they can't be shared
+                        self._numerator, self._denominator = _writable_copy(self._numerator), \
+                                                             _writable_copy(self._denominator)
+                else:
+                    self.numerator = data.numerator
+                    self.denominator = data.denominator
+                if data._factors is not None:
+                    self._factors = list(data._factors)
                 self.locs = data.locs
                 self.meta = data.meta
                 self.n_subs = data.n_subs
-                self.numerator = data.numerator
                 self.rbf_width = data.rbf_width
+                self.rbf_cutoff = data.rbf_cutoff
                 #self = copy.deepcopy(data)
                 n_subs = self.n_subs
             elif isinstance(data, Brain):
                 corrmat = _get_corrmat(data)
-                self.__init__(data=corrmat, locs=data.get_locs(), n_subs=1)
+                self.__init__(data=corrmat, locs=data.get_locs(), n_subs=1, rbf_cutoff=self.rbf_cutoff,
+                              factorize=factorize, packed=self.packed, dtype=self.dtype,
+                              projection_cache_size=projection_cache_size)
+            elif isinstance(data, CorrelationAccumulator):
+                #use the (duration-weighted) z-transformed correlations directly, rather than round-tripping them
+                #through correlations
+                z_numerator = _to_log_complex(data.get_corrmat(z_transform=True))
+                self.__init__(numerator=z_numerator, denominator=np.zeros(z_numerator.shape, dtype=np.float32),
+                              locs=data.get_locs(), n_subs=1, rbf_cutoff=self.rbf_cutoff, factorize=factorize,
+                              packed=self.packed, dtype=self.dtype, projection_cache_size=projection_cache_size)
             elif isinstance(data, np.ndarray):
                 assert not (locs is None), 'must specify model locations'
                 assert locs.shape[0] == data.shape[0], 'number of locations must match the size of the given correlation matrix'
@@ -152,24 +284,40 @@ class Model(object):
                 self.denominator = np.zeros_like(self.numerator, dtype=np.float32)
 
         if not ((numerator is None) or (denominator is None)):
-            assert numerator.shape[0] == numerator.shape[1], 'numerator must be a square matrix'
-            assert denominator.shape[0] == denominator.shape[1], 'denominator must be a square matrix'
-            assert numerator.shape[0] == denominator.shape[0], 'numerator and denominator must be the same shape'
+            num_shape = numerator.shape[1:] if planes else numerator.shape
+            assert num_shape == denominator.shape, 'numerator and denominator must be the same shape'
             assert not (locs is None), 'must specify model locations'
-            assert locs.shape[0] == numerator.shape[0], 'number of locations must match the size of the numerator ' \
-                                                        'and denominator matrices'
-
-            if (self.numerator is None) or (self.denominator is None):
-                self.numerator = numerator
-                self.denominator = denominator
+            if len(num_shape) == 1: #packed upper triangles
+                assert _triu_size(num_shape[0]) == locs.shape[0], 'number of locations must match the size ' \
+                                                                  'of the packed numerator and denominator'
+            else:
+                assert num_shape[0] == num_shape[1], 'numerator must be a square matrix'
+                assert locs.shape[0] == num_shape[0], 'number of locations must match the size of the ' \
+                                                      'numerator and denominator matrices'
+            numerator = self._to_storage(numerator, numerator=True)
+            denominator = self._to_storage(denominator)
+
+            stored_num, stored_den = self._stored()
+            if (stored_num is None) or (stored_den is None):
+                self._numerator, self._denominator = numerator, denominator
             else: #numerator and denominator may have already been inferred data; effectively the user has now passed in *two* sets of data
-                self._set_numerator(np.logaddexp(self.numerator.real, numerator.real),
-                                    np.logaddexp(self.numerator.imag, numerator.imag))
-                self.denominator = np.logaddexp(self.denominator, denominator)
+                self._numerator, self._denominator = self._log_add(stored_num, stored_den, numerator, denominator,
+                                                                   inplace=False)
+            self._factors = None
 
             self.locs = locs
             self.n_subs += n_subs
 
+        if not (factors is None):
+            assert not (locs is None), 'must specify model locations'
+            self._factors = [(np.asarray(f_locs), np.asarray(f_Z)) for f_locs, f_Z in factors]
+            self.locs = locs
+            self.n_subs += n_subs
+
+        if factorize and (self._factors is None) and not (self._numerator is None) and \
+                np.all(self._denominator == 0): #single-subject data can be factorized exactly
+            self._factors = [(np.asarray(self.locs), self.get_model(z_transform=True))]
+
         if not (template is None): #blur correlation matrix out to template locations
             if not (locs is None):
                 warnings.warn('Argument ''locs'' will be ignored in favor of the provided Nifti template')
@@ -177,14 +325,20 @@ class Model(object):
                 template = load(template)
             assert type(template) == Nifti, 'template must be a Nifti object or a path to a Nifti object'
             bo = Brain(template)
-            rbf_weights = _log_rbf(bo.get_locs(), self.locs, width=self.rbf_width)
-            self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
+            if not self._is_single_factor():
+                rbf_weights = _log_rbf(bo.get_locs(), self.locs, width=self.rbf_width, cutoff=self.rbf_cutoff)
+                self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
+            else: #blurring the subject's factor is the same as blurring the model
+                self._clear_cache()
             self.locs = bo.get_locs()
         elif not (locs is None): #blur correlation matrix out to locs
-            if (isinstance(data, Brain) or isinstance(data, Model)): #self.locs may now conflict with locs
+            if isinstance(data, (Brain, Model, CorrelationAccumulator)): #self.locs may now conflict with locs
                 if not ((locs.shape[0] == self.locs.shape[0]) and np.allclose(locs, self.locs)):
-                    rbf_weights = _log_rbf(locs, self.locs, width=self.rbf_width)
-                    self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
+                    if not self._is_single_factor():
+                        rbf_weights = _log_rbf(locs, self.locs, width=self.rbf_width, cutoff=self.rbf_cutoff)
+                        self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
+                    else: #blurring the subject's factor is the same as blurring the model
+                        self._clear_cache()
                     self.locs = locs
         elif self.locs is None:
             self.locs = locs
@@ -193,8 +347,12 @@ class Model(object):
 
         #sort locations and force them to be unique
         self.locs, loc_inds = _unique(self.locs)
-        self.numerator = self.numerator[loc_inds, :][:, loc_inds]
-        self.denominator = self.denominator[loc_inds, :][:, loc_inds]
+        if self._factors is None:
+            if not _is_identity(loc_inds): #avoid copying (e.g. memory-mapped) matrices that are already sorted
+                self.numerator = self.numerator[loc_inds, :][:, loc_inds]
+                self.denominator = self.denominator[loc_inds, :][:, loc_inds]
+        else:
+            self._clear_cache()
         self.n_locs = self.locs.shape[0]
 
         if not type(self.locs) == pd.DataFrame:
@@ -212,12 +370,244 @@ class Model(object):
             else:
                 warnings.warn('bad filename, cannot save to disk: ' + str(save))
 
+    @property
+    def numerator(self):
+        return self._from_storage(self._stored()[0], numerator=True)
+
+    @numerator.setter
+    def numerator(self, value):
+        self._numerator = self._to_storage(value, numerator=True)
+        self._factors = None
+        self._clear_projections()
+
+    @property
+    def denominator(self):
+        return self._from_storage(self._stored()[1])
+
+    @denominator.setter
+    def denominator(self, value):
+        self._denominator = self._to_storage(value)
+        self._factors = None
+        self._clear_projections()
+
+    @property
+    def locs(self):
+        return self._locs
+
+    @locs.setter
+    def locs(self, value):
+        self._locs = value
+        self._location_indices = {}
+        self._clear_projections()
+
+    @property
+    def _planes(self):
+        return not (self.dtype is None)
+
+    def _storage_format(self):
+        """
+        Internal function that returns a (hashable) description of how the numerator and denominator are stored
+        """
+        return self.packed, (None if self.dtype is None else self.dtype.name)
+
+    def _stored(self):
+        """
+        Internal function that returns the numerator and denominator as they are stored (packed or not)
+        """
+        if ((self._numerator is None) or (self._denominator is None)) and not (self._factors is None):
+            self._materialize()
+        return self._numerator, self._denominator
+
+    def _to_storage(self, x, numerator=False):
+        """
+        Internal function for converting a numerator or denominator to the model's storage format
+        """
+        if x is None:
+            return x
+        planes = numerator and _is_planes(x, self.dtype)
+        if self.packed and (np.ndim(x) - int(planes) == 2):
+            x = _pack_triu(x)
+        if numerator and self._planes and not planes:
+            x = _to_log_planes(x, dtype=self.dtype)
+        elif self._planes:
+            x = x.astype(self.dtype, copy=False)
+        return x
+
+    def _from_storage(self, x, numerator=False, expand=True):
+        """
+        Internal function for converting a stored numerator (to complex numbers) or denominator, and (if expand is
+        True) expanding it to a full matrix
+        """
+        if x is None:
+            return x
+        if self._planes:
+            x = _from_log_planes(x) if numerator else x.astype(np.float64)
+        if expand and self.packed and (np.ndim(x) == 1):
+            x = _unpack_triu(x)
+        return x
+
+    def _index_stored(self, inds):
+        """
+        Internal function that returns the stored numerator and denominator (in the model's storage format) of the
+        given locations (in the given order).  Packed upper triangles are indexed directly, without expanding them.
+        """
+        numerator, denominator = self._stored()
+        if self.packed:
+            inds = np.arange(self.n_locs)[inds]
+            rows, cols = np.triu_indices(len(inds))
+            packed_inds = _triu_index(inds[rows], inds[cols], self.n_locs)
+            return numerator[..., packed_inds], denominator[..., packed_inds]
+        return numerator[..., inds, :][..., inds], denominator[..., inds, :][..., inds]
+
+    def _log_add(self, num1, den1, num2, den2, inplace=True):
+        """
+        Internal function for combining two stored numerators and denominators (in the model's storage format).  If
+        inplace is True, log planes are combined and simplified in place (when num1 and den1 are writable).
+        """
+        if self._planes:
+            inplace = inplace and num1.flags.writeable and den1.flags.writeable
+            num = np.logaddexp(num1, num2, out=num1 if inplace else None)
+            num = _simplify_log_planes(num)
+            den = np.logaddexp(den1, den2, out=den1 if inplace else None)
+            return num, den
+
+        num = np.zeros_like(num1, dtype=np.complex128)
+        num.real = np.logaddexp(num1.real, num2.real)
+        num.imag = np.logaddexp(num1.imag, num2.imag)
+        #simplify to ensure that each entry of the numerator has either a non-zero real part OR a non-zero imag part
+        #(or neither).
+        return _to_log_complex(_to_exp_real(num)), np.logaddexp(den1, den2)
+
+    def _materialize(self):
+        """
+        Internal function for computing (and caching) the numerator and denominator of a factorized model
+        """
+        num, den = None, None
+        for f_locs, f_Z in self._factors:
+            rbf_weights = _log_rbf(self.locs, f_locs, width=self.rbf_width, cutoff=self.rbf_cutoff)
+            n, d = _blur_corrmat(f_Z, rbf_weights)
+            if num is None:
+                num, den = n, d
+            else:
+                num.real = np.logaddexp(num.real, n.real)
+                num.imag = np.logaddexp(num.imag, n.imag)
+                den = np.logaddexp(den, d)
+
+        if len(self._factors) > 1:
+            num = _to_log_complex(_to_exp_real(num))
+        self._numerator = self._to_storage(num, numerator=True)
+        self._denominator = self._to_storage(den)
+
+    def _is_single_factor(self):
+        """
+        Internal function that returns True if the model comprises a single subject's factor at the model's own
+        locations (so that blurring the factor is the same as blurring the model)
+        """
+        if (self._factors is None) or (len(self._factors) != 1):
+            return False
+        f_locs = self._factors[0][0]
+        return (f_locs.shape == self.locs.shape) and np.allclose(f_locs, self.locs)
+
+    def _defactorize(self):
+        """
+        Internal function that replaces the factors of a factorized model with its (materialized) numerator and
+        denominator
+        """
+        if not (self._factors is None):
+            self._stored()
+            self._factors = None
+            self._clear_projections()
+
+    def _clear_cache(self):
+        """
+        Internal function for dropping the cached numerator and denominator of a factorized model
+        """
+        if not (self._factors is None):
+            self._numerator = None
+            self._denominator = None
+        self._clear_projections()
+
+    def _clear_projections(self):
+        """
+        Internal function for dropping the cached projection operators (see _get_projection) and model views (see
+        _get_view)
+        """
+        if hasattr(self, '_projections'):
+            self._projections.clear()
+        if hasattr(self, '_views'):
+            self._views.clear()
+
+    def _location_index(self, decimals=None):
+        """
+        Internal function that returns a (cached) _LocationIndex of the model's locations, for looking up the rows
+        of the model corresponding to a set of locations (rounded to the given number of decimals, if not None)
+        """
+        if not (decimals in self._location_indices):
+            self._location_indices[decimals] = _LocationIndex(self.get_locs(), decimals=decimals)
+        return self._location_indices[decimals]
+
+    def _get_projection(self, known_inds, unknown_inds, solver='pinv', ridge=0.):
+        """
+        Internal function that returns the operator Kba * Kaa^-1 that maps (z-scored) activity at the model locations
+        given by known_inds onto the locations given by unknown_inds (see _solve_projection for solver and ridge).  The
+        most recently used operators are cached.
+        """
+        return _cached_projection(self, known_inds, unknown_inds, solver=solver, ridge=ridge)
+
+    def _get_view(self, locs):
+        """
+        Internal function that returns a read-only _ModelView of the model blurred out to include the given
+        locations.  The most recently used views (and hence their projection operators) are cached, keyed by the
+        (exact) set of locations that are not already in the model, which are the locations the view adds.  If all of
+        the locations are already in the model, the model itself is returned.
+        """
+        in_model = _count_overlapping(self.get_locs(), locs)
+        if np.all(in_model):
+            return self
+        added = _unique(np.asarray(locs, dtype=np.float64)[~in_model])[0]
+        key = added.tobytes()
+        if key in self._views:
+            view = self._views.pop(key)
+        else:
+            view = _ModelView(self, added)
+
+        if self.projection_cache_size > 0:
+            self._views[key] = view
+            while len(self._views) > self.projection_cache_size:
+                self._views.popitem(last=False)
+        return view
+
     def get_model(self, z_transform=False):
         """ Returns a copy of the model in the form of a correlation matrix"""
-        if (self.numerator is None) or (self.denominator is None):
+        num, den = self._stored()
+        if (num is None) or (den is None):
             m = np.eye(self.n_locs)
         else:
-            m = _recover_model(self.numerator, self.denominator, z_transform=z_transform)
+            m = _recover_model(self._from_storage(num, numerator=True), self._from_storage(den),
+                               z_transform=z_transform)
+            m[np.isnan(m)] = 0
+        return m
+
+    def get_rows(self, inds, z_transform=False):
+        """
+        Returns a copy of the given rows of the model (in the form of a correlation matrix), without computing
+        (or reading) the rest of the model
+        """
+        inds = np.atleast_1d(np.asarray(inds))
+        if inds.dtype == bool:
+            inds = np.where(inds)[0]
+
+        num, den = self._stored()
+        if (num is None) or (den is None):
+            m = np.eye(self.n_locs)[inds, :]
+        else:
+            if self.packed:
+                packed_inds = _triu_index(inds[:, np.newaxis], np.arange(self.n_locs)[np.newaxis, :], self.n_locs)
+                num, den = num[..., packed_inds], den[..., packed_inds]
+            else:
+                num, den = num[..., inds, :], den[..., inds, :]
+            m = _recover_model(self._from_storage(num, numerator=True, expand=False),
+                               self._from_storage(den, expand=False), z_transform=z_transform, diag_inds=inds)
             m[np.isnan(m)] = 0
         return m
 
@@ -255,27 +645,46 @@ class Model(object):
 
         new_locs_in_self = _count_overlapping(self.get_locs(), new_locs)
 
+        if not (self._factors is None):
+            if np.all(new_locs_in_self) or self._is_single_factor():
+                #each blurred entry only depends on its own pair of locations, so the subjects' factors can be blurred
+                #directly onto a subset of the locations (or onto any locations, if the model is a single subject's
+                #factor)
+                self.locs, tmp = _unique(new_locs)
+                self.n_locs = self.locs.shape[0]
+                self._clear_cache()
+                return
+            #added locations are blurred from the combined model (as for a model that is not factorized)
+            self._defactorize()
+
         if np.all(new_locs_in_self):
             inds = _count_overlapping(new_locs, self.get_locs())
+            if np.all(inds): #nothing to remove (avoids copying memory-mapped matrices)
+                return
+            self._numerator, self._denominator = self._index_stored(inds)
             self.locs = self.locs.iloc[inds, :]
             self.n_locs = self.locs.shape[0]
-            self.numerator = self.numerator[inds, :][:, inds]
-            self.denominator = self.denominator[inds, :][:, inds]
             return
         else:
-            rbf_weights = _log_rbf(new_locs, self.get_locs())
-            self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
+            rbf_weights = _log_rbf(new_locs, self.get_locs(), cutoff=self.rbf_cutoff)
+            if np.all(_count_overlapping(new_locs, self.get_locs())): #only blur the rows of the added locations
+                added = np.where(~new_locs_in_self)[0]
+                self.numerator, self.denominator = _expand_corrmat(self.get_model(z_transform=True), rbf_weights,
+                                                                   added)
+            else:
+                self.numerator, self.denominator = _blur_corrmat(self.get_model(z_transform=True), rbf_weights)
             self.locs = new_locs
 
         self.locs, loc_inds = _unique(self.locs)
-        self.numerator = self.numerator[loc_inds, :][:, loc_inds]
-        self.denominator = self.denominator[loc_inds, :][:, loc_inds]
         self.n_locs = self.locs.shape[0]
+        if not _is_identity(loc_inds):
+            self._numerator, self._denominator = self._index_stored(loc_inds)
 
 
 
     def predict(self, bo, nearest_neighbor=False, match_threshold='auto',
-                force_update=False, force_include_bo_locs=True, preprocess='zscore'):
+                force_update=False, force_include_bo_locs=True, preprocess='zscore', solver='pinv', ridge=0.,
+                target_locs=None):
         """
         Takes a brain object and a 'full' covariance model, fills in all
         electrode timeseries for all missing locations and returns the new brain
@@ -300,9 +709,21 @@ class Model(object):
             If True, and if force_update = False, update the locations in the model to include the locations in the
             given brain object prior to generating the predictions.  If force_update = True, this parameter is
             forced to be True (force_update requires updating the locations) and the specified value is ignored.
+            The model itself is never modified: predictions are made using a (copy-on-write) view of the model.
         preprocess : 'zscore' or None
             The predict algorithm requires the data to be zscored.  However, if
             your data are already zscored you can bypass this by setting to None.
+        solver : 'pinv' or 'cholesky'
+            How the correlation matrix of the observed locations is inverted.  'pinv' (default) uses the
+            pseudo-inverse.  'cholesky' uses a (much faster) Cholesky solve, falling back on an eigendecomposition
+            if the (regularized) matrix is not positive definite.
+        ridge : float
+            Regularization strength: ridge is added to the diagonal of the correlation matrix of the observed
+            locations before it is inverted.  (Default: 0)
+        target_locs : pandas.DataFrame, np.ndarray or None
+            If specified, only return the timeseries at these locations (e.g. regions of interest), which must be
+            model locations or locations in the brain object.  Only the unobserved target locations are
+            reconstructed.  (Default: None, return all model locations)
 
         Returns
         ----------
@@ -310,6 +731,113 @@ class Model(object):
             New brain data object with missing electrode locations filled in
         """
 
+        bor, mo = self._predict_setup(bo, nearest_neighbor=nearest_neighbor, match_threshold=match_threshold,
+                                      force_update=force_update, force_include_bo_locs=force_include_bo_locs)
+        target_inds = _target_inds(mo, target_locs)
+
+        activations = _timeseries_recon(bor, mo, preprocess=preprocess, solver=solver, ridge=ridge,
+                                        target_inds=target_inds)
+
+        return Brain(data=activations, locs=_predict_locs(mo, target_inds), sessions=bor.sessions,
+                     sample_rate=bor.sample_rate, label=_predict_labels(bor, mo, target_inds), filter=None)
+
+    def predict_stream(self, bo, chunk_size=1000, sink=None, nearest_neighbor=False, match_threshold='auto',
+                       force_update=False, force_include_bo_locs=True, preprocess='zscore', solver='pinv', ridge=0.,
+                       target_locs=None):
+        """
+        Streaming version of predict: fills in the electrode timeseries for all missing locations, one chunk of
+        samples at a time, so that the full (samples x model locations) reconstruction never needs to be held in
+        memory.  Each session's reconstructions are z-scored using running statistics of the observed data, so the
+        concatenated chunks are identical to the data returned by predict.
+
+        Parameters
+        ----------
+        bo : a Brain, Nifti, or Model object that will be converted to a Brain object.
+        chunk_size : int
+            Maximum number of samples in each chunk (chunks never span multiple sessions).  (Default: 1000)
+        sink : callable or None
+            If specified, each chunk is passed to sink (e.g. a function that writes the chunk to disk) and None is
+            returned.  Otherwise a generator of chunks is returned.  (Default: None)
+        nearest_neighbor, match_threshold, force_update, force_include_bo_locs, preprocess, solver, ridge, target_locs :
+            See predict
+
+        Returns
+        ----------
+        chunks : generator of supereeg.Brain objects (or None if sink is specified)
+            Brain data objects containing consecutive samples of the reconstructed data
+        """
+        bor, mo = self._predict_setup(bo, nearest_neighbor=nearest_neighbor, match_threshold=match_threshold,
+                                      force_update=force_update, force_include_bo_locs=force_include_bo_locs)
+        chunks = _predict_chunks(bor, mo, chunk_size=chunk_size, preprocess=preprocess, solver=solver, ridge=ridge,
+                                 target_inds=_target_inds(mo, target_locs))
+
+        if sink is None:
+            return chunks
+        for chunk in chunks:
+            sink(chunk)
+
+    def predict_many(self, bos, n_jobs=1, nearest_neighbor=False, match_threshold='auto', force_update=False,
+                     force_include_bo_locs=True, preprocess='zscore', solver='pinv', ridge=0., target_locs=None):
+        """
+        Makes predictions for many brain objects (e.g. a cohort of patients) using the same model.  The predictions
+        are identical to calling predict on each brain object, but patients with identical electrode montages share a
+        single (copy-on-write) view of the model blurred out to their locations, and hence a single projection
+        operator, and groups of patients are processed in parallel (the model's arrays are shared with the worker
+        processes via memory mapping, rather than copied).  Each view only holds the rows of its montage's added
+        locations, so memory use grows with the size of the largest montage rather than with the total number of
+        locations across brain objects.
+
+        Parameters
+        ----------
+        bos : list of Brain, Nifti, or Model objects that will be converted to Brain objects
+        n_jobs : int
+            Number of parallel jobs (-1 uses all available cores).  (Default: 1)
+        nearest_neighbor, match_threshold, force_update, force_include_bo_locs, preprocess, solver, ridge, target_locs :
+            See predict.  If force_update is True, or if force_include_bo_locs is False, the model depends on each
+            brain object and each prediction is made separately (without sharing any computations).
+
+        Returns
+        ----------
+        bos_p : list of supereeg.Brain
+            New brain data objects with missing electrode locations filled in (in the same order as bos)
+        """
+        if force_update or not force_include_bo_locs or _empty(self.locs):
+            return [Model(self).predict(bo, nearest_neighbor=nearest_neighbor, match_threshold=match_threshold,
+                                        force_update=force_update, force_include_bo_locs=force_include_bo_locs,
+                                        preprocess=preprocess, solver=solver, ridge=ridge, target_locs=target_locs)
+                    for bo in bos]
+
+        bors = []
+        for bo in bos:
+            if not isinstance(bo, Brain):
+                bo = Brain(bo)
+            bor = bo.apply_filter(inplace=False)
+            if nearest_neighbor:
+                bor = _near_neighbor(bor, self, match_threshold=match_threshold)
+            bors.append(bor)
+
+        #group the brain objects by (exact) electrode montage; each group's view of the model is built when the group
+        #is processed, so only one view per job is held at a time
+        groups = OrderedDict()
+        for i, bor in enumerate(bors):
+            groups.setdefault(bor.get_locs().as_matrix().tobytes(), []).append(i)
+
+        results = Parallel(n_jobs=n_jobs)(delayed(_predict_group)(self, [bors[i] for i in inds],
+                                                                  target_locs=target_locs, preprocess=preprocess,
+                                                                  solver=solver, ridge=ridge)
+                                          for inds in groups.values())
+
+        bos_p = [None] * len(bors)
+        for inds, group_results in zip(groups.values(), results):
+            for i, bo_p in zip(inds, group_results):
+                bos_p[i] = bo_p
+        return bos_p
+
+    def _predict_setup(self, bo, nearest_neighbor=False, match_threshold='auto', force_update=False,
+                       force_include_bo_locs=True):
+        """
+        Internal function that prepares a brain object and model for making predictions (see predict)
+        """
         if not isinstance(bo, Brain):
             bor = Brain(bo)
 
@@ -326,18 +854,16 @@ class Model(object):
         # if True will update the model with subject's correlation matrix
         if force_update:
             mo = self.update(bor, inplace=False)
+        elif force_include_bo_locs and not _empty(self.locs):
+            #blur out a (copy-on-write) view of the model to include the brain object locations, leaving the model
+            #itself unchanged
+            return bor, self._get_view(bor.get_locs())
         else:
-            mo = self
+            mo = Model(self)
 
         #blur out model to include brain object locations
         mo.set_locs(bor.get_locs(), force_include_bo_locs=force_include_bo_locs)
-
-        activations = _timeseries_recon(bor, mo, preprocess=preprocess)
-        loc_labels = np.array(['observed'] * len(mo.get_locs()))
-        loc_labels[~_count_overlapping(bor.get_locs(), mo.get_locs())] = ['reconstructed']
-
-        return Brain(data=activations, locs=mo.locs, sessions=bor.sessions, sample_rate=bor.sample_rate,
-                     label=loc_labels.tolist(), filter=None)
+        return bor, mo
 
 
     def update(self, data, inplace=True):
@@ -363,19 +889,24 @@ class Model(object):
 
         assert m1.meta['stable']==True, 'solution unstable'
 
-        m2 = Model(data)
+        m2 = Model(data, rbf_cutoff=m1.rbf_cutoff, factorize=not (m1._factors is None), packed=m1.packed,
+                   dtype=m1.dtype)
         locs = _union(m1.get_locs(), m2.get_locs())
 
         m1.set_locs(locs)
         m2.set_locs(locs)
 
-        m1._set_numerator(np.logaddexp(m1.numerator.real, m2.numerator.real),
-                          np.logaddexp(m1.numerator.imag, m2.numerator.imag))
-        #simplify to ensure that each entry of the numerator has either a non-zero real part OR a non-zero imag part
-        #(or neither).
-        n = _to_log_complex(_to_exp_real(m1.numerator))
-        m1._set_numerator(n.real, n.imag)
-        m1.denominator = np.logaddexp(m1.denominator, m2.denominator)
+        if not ((m1._factors is None) or (m2._factors is None)):
+            m1._factors = m1._factors + m2._factors
+            m1._clear_cache()
+        else:
+            (num1, den1), (num2, den2) = m1._stored(), m2._stored()
+            if m1._storage_format() != m2._storage_format():
+                num2, den2 = m1._to_storage(m2.numerator, numerator=True), m1._to_storage(m2.denominator)
+
+            m1._numerator, m1._denominator = m1._log_add(num1, den1, num2, den2)
+            m1._factors = None
+            m1._clear_projections()
         m1.locs = locs
         m1.n_locs = locs.shape[0]
         m1.n_subs += m2.n_subs
@@ -395,9 +926,10 @@ class Model(object):
         """
         Internal function for setting the numerator (deals with size mismatches)
         """
-        self.numerator = np.zeros_like(n_real, dtype=np.complex128)
-        self.numerator.real = n_real
-        self.numerator.imag = n_imag
+        numerator = np.zeros_like(n_real, dtype=np.complex128)
+        numerator.real = n_real
+        numerator.imag = n_imag
+        self.numerator = numerator
 
 
     def info(self):
@@ -409,6 +941,7 @@ class Model(object):
         print('Number of locations: ' + str(self.n_locs))
         print('Number of subjects: ' + str(self.n_subs))
         print('RBF width: ' + str(self.rbf_width))
+        print('RBF cutoff: ' + str(self.rbf_cutoff))
         print('Date created: ' + str(self.date_created))
         print('Meta data: ' + str(self.meta))
 
@@ -460,7 +993,7 @@ class Model(object):
         else:
             _plot_locs_hyp(locs, pdfpath)
 
-    def save(self, fname, compression='blosc'):
+    def save(self, fname, compression='blosc', mmap=False):
         """
         Save method for the model object
         The data will be saved as a 'mo' file, which is a dictionary containing
@@ -475,21 +1008,38 @@ class Model(object):
         compression : str
             The kind of compression to use.  See the deepdish documentation for
             options: http://deepdish.readthedocs.io/en/latest/api_io.html#deepdish.io.save
+        mmap : bool
+            If True, the numerator and denominator are saved to separate .npy files (alongside the .mo file) that are
+            memory-mapped, rather than read into memory, when the model is loaded.  The .mo file stores the absolute
+            paths to the .npy files, so they must be moved along with it.  (Default: False)
         """
 
+        if fname[-3:]!='.mo':
+            fname+='.mo'
+
+        if self._factors is None:
+            numerator, denominator = self._stored()
+            factors = None
+            if mmap:
+                numerator = _save_npy(fname[:-3] + '_numerator.npy', numerator)
+                denominator = _save_npy(fname[:-3] + '_denominator.npy', denominator)
+        else:
+            numerator, denominator, factors = None, None, [list(f) for f in self._factors]
+
         mo = {
-            'numerator' : self.numerator,
-            'denominator' : self.denominator,
+            'numerator' : numerator,
+            'denominator' : denominator,
+            'factors' : factors,
             'locs' : self.locs,
             'n_subs' : self.n_subs,
             'meta' : self.meta,
             'date_created' : self.date_created,
-            'rbf_width' : self.rbf_width
+            'rbf_width' : self.rbf_width,
+            'rbf_cutoff' : self.rbf_cutoff,
+            'packed' : self.packed,
+            'dtype' : None if self.dtype is None else self.dtype.name
         }
 
-        if fname[-3:]!='.mo':
-            fname+='.mo'
-
         dd.io.save(fname, mo, compression=compression)
 
     def get_slice(self, loc_inds, inplace=False):
@@ -508,23 +1058,35 @@ class Model(object):
             If True, indexes in place.
 
         """
-        numerator = self.numerator[loc_inds][:, loc_inds]
-        denominator = self.denominator[loc_inds][:, loc_inds]
         locs = self.locs.iloc[loc_inds]
         n_subs = self.n_subs
         meta = self.meta
         date_created = time.strftime("%c")
 
+        if not (self._factors is None):
+            if inplace:
+                self.locs = locs.reset_index(drop=True)
+                self.n_locs = self.locs.shape[0]
+                self.date_created = date_created
+                self._clear_cache()
+            else:
+                return Model(factors=self._factors, locs=locs, n_subs=n_subs, meta=meta, date_created=date_created,
+                             rbf_width=self.rbf_width, rbf_cutoff=self.rbf_cutoff)
+            return
+
+        numerator, denominator = self._index_stored(loc_inds)
+
         if inplace:
-            self.numerator = numerator
-            self.denominator = denominator
+            self._numerator = numerator
+            self._denominator = denominator
             self.locs = locs
             self.n_subs = n_subs
             self.meta = meta
             self.date_created = date_created
         else:
             return Model(numerator=numerator, denominator=denominator, locs=locs,
-                         n_subs=n_subs, meta=meta, date_created=date_created, rbf_width=self.rbf_width)
+                         n_subs=n_subs, meta=meta, date_created=date_created, rbf_width=self.rbf_width,
+                         rbf_cutoff=self.rbf_cutoff, packed=self.packed, dtype=self.dtype)
 
     def __add__(self, other):
         """
@@ -577,10 +1139,109 @@ class Model(object):
         np.fill_diagonal(m2_z, 1)
 
         return Model(data=_z2r(np.divide(np.subtract(m1_z,m2_z), (m1.n_subs-m2.n_subs))),
-                     locs=locs, n_subs=m1.n_subs - m2.n_subs, meta=meta, rbf_width=m1.rbf_width)
+                     locs=locs, n_subs=m1.n_subs - m2.n_subs, meta=meta, rbf_width=m1.rbf_width,
+                     rbf_cutoff=m1.rbf_cutoff)
 
 
 
+class _ModelView(object):
+    """
+    Read-only view of a model that has been blurred out to additional locations (as though
+    model.set_locs(locs, force_include_bo_locs=True) had been called on a copy of the model).  The base model's
+    matrices are neither copied nor modified: rows of the view are assembled from rows of the base model, plus an
+    overlay containing the (blurred) rows of the added locations.
+
+    A view is not a Model; it only supports reading rows (get_rows, get_model) and the projection operators used by
+    predict.  To modify the blurred model, use Model(model) and set_locs instead.
+
+    Parameters
+    ----------
+    model : supereeg.Model
+        The base model (a factorized model is materialized when its rows are read)
+    locs : pandas.DataFrame or Numpy.ndarray
+        Locations to add to the model
+    """
+    def __init__(self, model, locs):
+        self.base = model
+        self.projection_cache_size = model.projection_cache_size
+        self._projections = OrderedDict()
+        self._location_indices = {}
+        self.meta = model.meta
+        self.rbf_width = model.rbf_width
+        self.rbf_cutoff = model.rbf_cutoff
+        self.n_subs = model.n_subs
+
+        self.locs = _union(model.get_locs(), locs)
+        self.n_locs = self.locs.shape[0]
+        base_pos = self._location_index().find(model.get_locs())
+        self._base_inds = np.full(self.n_locs, -1, dtype=np.int64)
+        self._base_inds[base_pos] = np.arange(len(base_pos))
+        self._base_pos = base_pos
+        self._added = np.where(self._base_inds < 0)[0]
+        self._added_inds = np.full(self.n_locs, -1, dtype=np.int64)
+        self._added_inds[self._added] = np.arange(len(self._added))
+
+        #only the rows of the base model for the locations that contribute to the added locations are read (all of
+        #them, unless the RBF is truncated, in which case the weights are sparse and are kept that way)
+        rbf_weights = _log_rbf(self.locs, model.get_locs(), cutoff=self.rbf_cutoff)
+        added_weights = _dense_log_weights(rbf_weights[self._added, :])
+        if np.any(np.isclose(added_weights, 0)): #added locations coincide with base locations
+            cols = np.arange(model.n_locs)
+        else:
+            cols = np.where(np.any(np.isfinite(added_weights), axis=0))[0]
+        Z_cols = model.get_rows(cols, z_transform=True).T #the model is symmetric
+        num, den = _blur_added(Z_cols, rbf_weights, self._added, cols=None if len(cols) == model.n_locs else cols)
+
+        #z-transformed and correlation rows of the added locations
+        z = _recover_model(num, den, z_transform=True, diag_inds=self._added)
+        r = _recover_model(num, den, z_transform=False, diag_inds=self._added)
+        z[np.isnan(z)] = 0
+        r[np.isnan(r)] = 0
+        self._overlay = (r, z)
+
+    def get_locs(self):
+        """ Returns the locations in the view
+        """
+        return self.locs
+
+    def get_model(self, z_transform=False):
+        """ Returns a copy of the (full) model in the form of a correlation matrix"""
+        return self.get_rows(np.arange(self.n_locs), z_transform=z_transform)
+
+    def get_rows(self, inds, z_transform=False):
+        """
+        Returns a copy of the given rows of the model (in the form of a correlation matrix)
+        """
+        inds = np.atleast_1d(np.asarray(inds))
+        if inds.dtype == bool:
+            inds = np.where(inds)[0]
+
+        m = np.zeros([len(inds), self.n_locs])
+        base_rows = self._base_inds[inds]
+        in_base = base_rows >= 0
+        if np.any(in_base):
+            m[np.ix_(np.where(in_base)[0], self._base_pos)] = self.base.get_rows(base_rows[in_base],
+                                                                                 z_transform=z_transform)
+        overlay = self._overlay[int(z_transform)]
+        m[:, self._added] = overlay[:, inds].T #the model is symmetric
+        m[~in_base, :] = overlay[self._added_inds[inds[~in_base]], :]
+        return m
+
+    def _location_index(self, decimals=None):
+        """
+        Internal function that returns a (cached) _LocationIndex of the view's locations (see Model._location_index)
+        """
+        if not (decimals in self._location_indices):
+            self._location_indices[decimals] = _LocationIndex(self.get_locs(), decimals=decimals)
+        return self._location_indices[decimals]
+
+    def _get_projection(self, known_inds, unknown_inds, solver='pinv', ridge=0.):
+        """
+        Internal function that returns the (cached) projection operator Kba * Kaa^-1 (see Model._get_projection)
+        """
+        return _cached_projection(self, known_inds, unknown_inds, solver=solver, ridge=ridge)
+
+
 ###################################
 # helper functions for init
 ###################################
@@ -610,16 +1271,63 @@ def _create_locs(self, locs, template):
     if self.locs.shape[0]>1000:
         warnings.warn('Model locations exceed 1000, this may take a while. Go get a cup of coffee or brew some tea!')
 
-def _bo2model(bo, locs, width=20):
+def _data_locs(data):
+    """Returns the locations of a (possibly not yet loaded) data object as a numpy array"""
+    from .load import load
+
+    if isinstance(data, six.string_types):
+        if data.split('.')[-1] in ('bo', 'mo'):
+            return np.atleast_2d(np.asarray(load(data, field='locs')))
+        data = load(data)
+    if isinstance(data, Nifti):
+        data = Brain(data)
+    return np.asarray(data.get_locs())
+
+def _build_partial(data, locs, template, width=20, cutoff=None):
+    """
+    Returns the (unsimplified) log numerator, log denominator, number of subjects, locations and meta data of the
+    model built from a batch of data objects, each blurred out to the given locations
+    """
+    partial = None
+    for d in data:
+        m = Model(data=d, locs=locs, template=template, rbf_width=width, rbf_cutoff=cutoff, n_subs=1)
+        if not (locs is None):
+            m.set_locs(pd.DataFrame(locs, columns=['x', 'y', 'z']))
+        next_partial = (m.numerator, m.denominator, m.n_subs, m.get_locs(), m.meta)
+        if partial is None:
+            partial = next_partial
+        else:
+            partial = _combine_partials(partial, next_partial)
+    return partial
+
+def _combine_partials(p1, p2=None):
+    """Combines two partial models (see _build_partial) with matching locations"""
+    if p2 is None:
+        return p1
+    num1, den1, n_subs1, locs1, meta1 = p1
+    num2, den2, n_subs2, locs2, meta2 = p2
+    assert locs1.shape[0] == locs2.shape[0] and np.allclose(locs1, locs2), 'partial models must have matching locations'
+
+    num = np.zeros_like(num1, dtype=np.complex128)
+    num.real = np.logaddexp(num1.real, num2.real)
+    num.imag = np.logaddexp(num1.imag, num2.imag)
+
+    meta = meta1
+    if type(meta1) == dict and type(meta2) == dict:
+        meta = copy.copy(meta1)
+        meta.update(meta2)
+    return num, np.logaddexp(den1, den2), n_subs1 + n_subs2, locs1, meta
+
+def _bo2model(bo, locs, width=20, cutoff=None):
     """Returns numerator and denominator given a brain object"""
     sub_corrmat = _get_corrmat(bo)
     #np.fill_diagonal(sub_corrmat, 0)
     sub_corrmat_z = _r2z(sub_corrmat)
-    sub_rbf_weights = _log_rbf(locs, bo.get_locs(), width=width)
+    sub_rbf_weights = _log_rbf(locs, bo.get_locs(), width=width, cutoff=cutoff)
     n, d = _blur_corrmat(sub_corrmat_z, sub_rbf_weights)
     return n, d, 1
 
-def _mo2model(mo, locs, width=20):
+def _mo2model(mo, locs, width=20, cutoff=None):
     """Returns numerator and denominator for model object"""
 
     if not isinstance(locs, pd.DataFrame):
@@ -630,11 +1338,11 @@ def _mo2model(mo, locs, width=20):
         # if the locations are not equivalent, map input model into locs space
         sub_corrmat_z = _recover_model(mo.numerator, mo.denominator, z_transform=True)
         #np.fill_diagonal(sub_corrmat_z, 0)
-        sub_rbf_weights = _log_rbf(locs, mo.locs, width=width)
+        sub_rbf_weights = _log_rbf(locs, mo.locs, width=width, cutoff=cutoff)
         n, d = _blur_corrmat(sub_corrmat_z, sub_rbf_weights)
         return n, d, mo.n_subs
 
-def _force_update(mo, bo, width=20):
+def _force_update(mo, bo, width=20, cutoff=None):
     # get subject-specific correlation matrix
     sub_corrmat = _get_corrmat(bo)
 
@@ -645,7 +1353,7 @@ def _force_update(mo, bo, width=20):
     sub_corrmat_z = _r2z(sub_corrmat)
 
     # get _rbf weights
-    sub__rbf_weights = _log_rbf(mo.locs, bo.get_locs(), width=width)
+    sub__rbf_weights = _log_rbf(mo.locs, bo.get_locs(), width=width, cutoff=cutoff)
 
     #  get subject expanded correlation matrix
     num_corrmat_x, denom_corrmat_x = _blur_corrmat(sub_corrmat_z, sub__rbf_weights)
@@ -657,14 +1365,123 @@ def _force_update(mo, bo, width=20):
     n.imag = np.logaddexp(n.imag, num_corrmat_x.imag)
     return _recover_model(n, np.logaddexp(mo.denominator, denom_corrmat_x), z_transform=True)
 
-def _recover_model(num, denom, z_transform=False):
+def _recover_model(num, denom, z_transform=False, diag_inds=None):
     warnings.simplefilter('ignore')
 
     m = np.divide(_to_exp_real(num), np.exp(denom)) #numerator and denominator are in log units
+    if diag_inds is None:
+        fill_diag = lambda x, v: np.fill_diagonal(x, v)
+    else: #num and denom contain the rows diag_inds of the full matrices
+        def fill_diag(x, v):
+            x[np.arange(len(diag_inds)), diag_inds] = v
+
     if z_transform:
-        np.fill_diagonal(m, np.inf)
+        fill_diag(m, np.inf)
         return m
     else:
         m = _z2r(m)
-        np.fill_diagonal(m, 1)
+        fill_diag(m, 1)
         return m
+
+def _cached_projection(mo, known_inds, unknown_inds, solver='pinv', ridge=0.):
+    """
+    Returns the operator Kba * Kaa^-1 of a model (or model view), using (and updating) its cache of the most
+    recently used operators (see Model._get_projection)
+    """
+    key = (tuple(np.asarray(known_inds).tolist()), tuple(np.asarray(unknown_inds).tolist()), solver, ridge)
+    if key in mo._projections:
+        projection = mo._projections.pop(key)
+    else:
+        #only the rows of the model corresponding to the observed locations are needed (the model is symmetric)
+        K_known = mo.get_rows(known_inds)
+        Kaa = K_known[:, known_inds]
+        Kba = K_known[:, unknown_inds].T
+        projection = _solve_projection(Kaa, Kba, solver=solver, ridge=ridge)
+
+    if mo.projection_cache_size > 0:
+        mo._projections[key] = projection
+        while len(mo._projections) > mo.projection_cache_size:
+            mo._projections.popitem(last=False)
+    return projection
+
+def _target_inds(mo, target_locs):
+    """Returns the indices of the model locations that match target_locs (or None if target_locs is None)"""
+    if target_locs is None:
+        return None
+    if isinstance(target_locs, pd.DataFrame):
+        target_locs = target_locs.as_matrix()
+    target_locs = np.atleast_2d(target_locs)
+    target_inds = mo._location_index(decimals=3).rows(target_locs)
+    assert len(target_inds) == target_locs.shape[0], 'target locations must be model or brain object locations'
+    return target_inds
+
+def _predict_locs(mo, target_inds=None):
+    """Returns the model locations (or the target locations) of a prediction"""
+    if target_inds is None:
+        return mo.locs
+    return mo.locs.iloc[target_inds].reset_index(drop=True)
+
+def _predict_labels(bo, mo, target_inds=None):
+    """Labels each model (or target) location as 'observed' (in the brain object) or 'reconstructed'"""
+    loc_labels = np.array(['observed'] * len(mo.get_locs()))
+    loc_labels[~_count_overlapping(bo.get_locs(), mo.get_locs())] = ['reconstructed']
+    if not (target_inds is None):
+        loc_labels = loc_labels[target_inds]
+    return loc_labels.tolist()
+
+def _predict_group(model, bos, target_locs=None, preprocess='zscore', solver='pinv', ridge=0.):
+    """Makes predictions for a group of brain objects with identical locations (see Model.predict_many)"""
+    mo = model._get_view(bos[0].get_locs())
+    target_inds = _target_inds(mo, target_locs)
+    labels = _predict_labels(bos[0], mo, target_inds)
+    locs = _predict_locs(mo, target_inds)
+
+    bos_p = []
+    for bo in bos:
+        activations = _timeseries_recon(bo, mo, preprocess=preprocess, solver=solver, ridge=ridge,
+                                        target_inds=target_inds)
+        bos_p.append(Brain(data=activations, locs=locs, sessions=bo.sessions, sample_rate=bo.sample_rate,
+                           label=labels, filter=None))
+    return bos_p
+
+def _predict_chunks(bo, mo, chunk_size=1000, preprocess='zscore', solver='pinv', ridge=0., target_inds=None):
+    """Generates Brain objects containing consecutive chunks of reconstructed data (see Model.predict_stream)"""
+    labels = _predict_labels(bo, mo, target_inds)
+    locs = _predict_locs(mo, target_inds)
+    sessions = np.asarray(bo.sessions)
+    unique_sessions = list(np.unique(sessions))
+
+    for inds, activations in _timeseries_recon_chunks(bo, mo, chunk_size=chunk_size, preprocess=preprocess,
+                                                      solver=solver, ridge=ridge, target_inds=target_inds):
+        session = sessions[inds[0]]
+        if bo.sample_rate is None:
+            sample_rate = None
+        else:
+            sample_rate = [bo.sample_rate[unique_sessions.index(session)]]
+        yield Brain(data=activations, locs=locs, sessions=sessions[inds], sample_rate=sample_rate,
+                    label=labels, filter=None)
+
+def _is_planes(numerator, dtype):
+    """Returns True if numerator is a (real-valued) stack of log planes (see Model's dtype argument)"""
+    return (not (dtype is None)) and (not (numerator is None)) and (not np.iscomplexobj(numerator))
+
+def _writable_copy(x):
+    """Copies writable arrays (read-only, e.g. memory-mapped, arrays are returned as is)"""
+    if (x is None) or not x.flags.writeable:
+        return x
+    return np.copy(x)
+
+def _is_identity(inds):
+    """Returns True if indexing with inds leaves an array unchanged"""
+    inds = np.asarray(inds)
+    return (inds.dtype != bool) and np.array_equal(inds, np.arange(len(inds)))
+
+def _save_npy(fname, x):
+    """
+    Saves x to fname (via a temporary file, so that x may be memory-mapped from fname) and returns the absolute path
+    """
+    fname = os.path.abspath(fname)
+    tmp_fname = fname[:-4] + '.tmp.npy'
+    np.save(tmp_fname, np.asarray(x))
+    os.rename(tmp_fname, fname)
+    return fname
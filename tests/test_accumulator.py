@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import supereeg as se
+import numpy as np
+from supereeg.helpers import _get_corrmat
+
+locs = np.array([[-61., -77.,  -3.],
+                 [-41., -77., -23.],
+                 [-21., -97.,  17.],
+                 [-21., -37.,  77.],
+                 [-21.,  63.,  -3.],
+                 [ -1., -37.,  37.],
+                 [ -1.,  23.,  17.],
+                 [ 19., -57., -23.]])
+
+data = np.random.multivariate_normal(np.zeros(8), np.eye(8) + 0.5, size=100)
+sessions = np.array([1] * 60 + [2] * 40)
+bo = se.Brain(data=data, locs=locs, sessions=sessions, sample_rate=[100, 50], filter=None)
+
+
+def test_create_accumulator():
+    acc = se.CorrelationAccumulator(locs, sample_rate=100)
+    assert isinstance(acc, se.CorrelationAccumulator)
+    assert acc.n_elecs == 8
+
+def test_accumulator_chunks():
+    acc = se.CorrelationAccumulator(locs, sample_rate={1: 100, 2: 50})
+    for start in range(0, 100, 7):
+        chunk = np.arange(start, min(start + 7, 100))
+        for session in (1, 2):
+            inds = chunk[sessions[chunk] == session]
+            acc.update(data[inds], session=session)
+    assert acc.n_samples == {1: 60, 2: 40}
+    assert np.allclose(acc.get_corrmat(), _get_corrmat(bo), equal_nan=True)
+
+def test_accumulator_brain():
+    acc = se.CorrelationAccumulator(locs)
+    acc.update(bo[:30])
+    acc.update(bo[30:])
+    assert np.allclose(acc.get_corrmat(), _get_corrmat(bo), equal_nan=True)
+
+def test_accumulator_model():
+    acc = se.CorrelationAccumulator(locs)
+    acc.update(bo)
+    mo = se.Model(acc)
+    assert isinstance(mo, se.Model)
+    assert np.allclose(mo.get_model(), se.Model(bo).get_model())
+    assert np.allclose(se.Model(acc, locs=locs[:3] + 1.).get_model(), se.Model(bo, locs=locs[:3] + 1.).get_model())
@@ -1,6 +1,7 @@
 from builtins import str
 import pytest
 import os
+import pickle
 import supereeg as se
 import numpy as np
 import pandas as pd
@@ -108,6 +109,81 @@ def test_brain_filter():
     assert bo.get_data().shape==(10,2)
     assert bo.get_locs().shape==(2,3)
 
+def test_brain_filter_cached():
+    data = np.random.rand(10, 3)
+    locs = np.random.rand(3, 3)
+    bo = se.Brain(data=data, locs=locs, sample_rate=1000, kurtosis=np.array([1., 20., 1.]))
+    assert bo.get_data() is bo.get_data()
+    assert np.allclose(bo.get_data().as_matrix(), data[:, [0, 2]])
+    assert np.allclose(bo.get_locs().as_matrix(), locs[[0, 2], :])
+    bo.kurtosis_threshold = 30
+    assert bo.get_data() is bo.data
+    bof = bo.apply_filter(inplace=False)
+    assert not np.shares_memory(bof.data.values, bo.data.values)
+    assert not np.shares_memory(bof.locs.values, bo.locs.values)
+    bo.data = pd.DataFrame(data[::-1])
+    assert np.allclose(bo.get_data().as_matrix(), data[::-1])
+
+def test_brain_float32(tmpdir):
+    data = np.random.rand(10, 3)
+    bo64 = se.Brain(data=data, locs=np.random.rand(3, 3), sessions=np.array([1] * 6 + [2] * 4), sample_rate=[10, 10],
+                    filter=None)
+    bo32 = se.Brain(data=data, locs=bo64.locs, sessions=bo64.sessions, sample_rate=[10, 10], filter=None,
+                    dtype=np.float32)
+    assert bo32._data.dtype == np.float32
+    assert np.shares_memory(bo32.data.values, bo32._data)
+    assert bo32.get_slice(sample_inds=[1, 2], loc_inds=[0, 2]).data.dtypes.tolist() == [np.float32] * 2
+    assert np.allclose(bo32.get_zscore_data(), bo64.get_zscore_data(), atol=1e-5)
+    fname = tmpdir.join('bo32').strpath
+    bo32.save(fname)
+    assert se.load(fname + '.bo').data.dtypes.tolist() == [np.float32] * 3
+    assert se.load(fname + '.bo', sample_inds=[1, 2]).data.dtypes.tolist() == [np.float32] * 3
+
+def test_brain_groupby():
+    data = np.random.rand(10, 3)
+    bo = se.Brain(data=data, locs=np.random.rand(3, 3), sessions=np.array([1] * 6 + [2] * 4), sample_rate=[10, 10],
+                  filter=None)
+    groups = bo.groupby('session')
+    assert len(groups) == 2
+    assert [session for session, x in groups] == [1, 2]
+    assert all(np.shares_memory(x, bo._data) for session, x in groups)
+    assert np.allclose(groups.stack(lambda x: x - 1), data - 1)
+    assert np.allclose(groups.reduce(lambda x: x.sum(0)), data.sum(0))
+    assert np.allclose(groups.reduce(lambda x: x.max(0), ufunc=np.maximum), data.max(0))
+
+def test_brain_kurtosis_lazy():
+    data = np.random.rand(10, 3)
+    bo = se.Brain(data=data, locs=np.random.rand(3, 3), sample_rate=10, filter=None)
+    assert bo._kurtosis is None
+    bs = bo[:5]
+    assert isinstance(bo._kurtosis, np.ndarray)
+    assert np.allclose(bs.kurtosis, bo.kurtosis)
+    assert np.allclose(pickle.loads(pickle.dumps(bs)).kurtosis, bo.kurtosis)
+    assert np.allclose(bo.get_slice(loc_inds=[2, 0]).kurtosis, bo.kurtosis[[2, 0]])
+
+def test_brain_slice_view():
+    data = np.random.rand(10, 3)
+    bo = se.Brain(data=data, locs=np.random.rand(3, 3), sessions=np.array([1] * 6 + [2] * 4), sample_rate=[10, 20],
+                  filter=None)
+    bs = bo[4:8]
+    assert np.shares_memory(bs.data.values, bo._data)
+    assert np.allclose(bs.get_data().as_matrix(), data[4:8])
+    assert bs.sessions.tolist() == [1, 1, 2, 2]
+    assert bs.sample_rate == [10, 20]
+    assert [b.data.shape for b in bo] == [(1, 3)] * 10
+
+def test_brain_windows():
+    data = np.random.rand(10, 3)
+    bo = se.Brain(data=data, locs=np.random.rand(3, 3), sessions=np.array([1] * 6 + [2] * 4), sample_rate=[10, 10],
+                  filter=None)
+    windows = list(bo.windows(length=3, overlap=1))
+    assert len(windows) == 3
+    assert np.allclose(windows[1], data[2:5])
+    assert np.allclose(windows[2], data[6:9])
+    assert all(np.shares_memory(w, bo._data) for w in windows)
+    assert len(list(bo.windows())) == 10
+    assert len(list(bo.windows(length=2, stride=3))) == 3
+
 ## can't get tests for plots to work
 
 # def test_bo_plot_locs(tmpdir):
@@ -8,11 +8,12 @@ from scipy.stats import kurtosis, zscore
 import os
 
 ## don't understand why i have to do this:
-from supereeg.helpers import _std, _gray, _resample_nii, _apply_by_file_index, _kurt_vals, _get_corrmat, _z2r, _r2z, \
-    _log_rbf, \
+from supereeg.helpers import _std, _gray, _resample_nii, _kurt_vals, _get_corrmat, _z2r, _r2z, \
+    _log_rbf, _blur_corrmat, \
     _timeseries_recon, _chunker, \
     _corr_column, _normalize_Y, _near_neighbor, _vox_size, _count_overlapping, _resample, \
-    _nifti_to_brain, _brain_to_nifti, _to_log_complex, _to_exp_real, _logsubexp
+    _nifti_to_brain, _brain_to_nifti, _to_log_complex, _to_exp_real, _logsubexp, _to_log_planes, _from_log_planes, \
+    _simplify_log_planes, _solve_projection, _match_locs, _corrcoef
 from supereeg.model import _recover_model
 
 locs = np.array([[-61., -77.,  -3.],
@@ -70,28 +71,18 @@ def test_resample_nii():
     nii = _resample_nii(_gray(), 20, precision=5)
     assert isinstance(nii, se.Nifti)
 
-def test_apply_by_file_index():
-    def vstack_aggregate(prev, next):
-        return np.max(np.vstack((prev, next)), axis=0)
-
-    def kurtosis_xform(bo):
-        return kurtosis(bo.data)
-
-    max_kurtosis_vals = _apply_by_file_index(data[0], kurtosis_xform, vstack_aggregate)
-    assert isinstance(max_kurtosis_vals, np.ndarray)
-
 def test_kurt_vals():
     kurts_2 = _kurt_vals(data[0])
     assert isinstance(kurts_2, np.ndarray)
 
-#NOTE: This test won't run because apply_by_file_index calls the kurtosis, but kurtosis doesnt support brain objects
-# def test_kurt_vals_compare():
-#     def aggregate(prev, next):
-#         return np.max(np.vstack((prev, next)), axis=0)
-#
-#     kurts_1 = _apply_by_file_index(data[0], kurtosis, aggregate)
-#     kurts_2 = _kurt_vals(data[0])
-#     assert np.allclose(kurts_1, kurts_2)
+def test_kurt_vals_scipy():
+    x = bo_full.data.as_matrix().copy()
+    x[:, 0] = 1.
+    sessions = bo_full.sessions.values
+    kurts = np.max([kurtosis(x[sessions == s]) for s in np.unique(sessions)], axis=0)
+    kurt_vals = _kurt_vals(se.Brain(data=x, locs=bo_full.locs, sessions=bo_full.sessions, sample_rate=10))
+    assert np.isnan(kurt_vals[0])
+    assert np.allclose(kurt_vals, kurts, equal_nan=True)
 
 def test_logsubexp():
     b_try = _to_exp_real(_logsubexp(c_log, a_log))
@@ -102,6 +93,15 @@ def test_get_corrmat():
     assert isinstance(corrmat, np.ndarray)
 
 
+def test_corrcoef():
+    X = np.random.randn(20, 4)
+    X[:, 2] = 1.
+    corrmat = _corrcoef(X)
+    assert np.allclose(corrmat[[0, 1, 3], :][:, [0, 1, 3]], np.corrcoef(X[:, [0, 1, 3]].T))
+    assert np.all(np.isnan(corrmat[2, [0, 1, 3]]))
+    assert np.allclose(np.diag(corrmat), 1)
+    assert np.allclose(_corrcoef(X.astype(np.float32)), corrmat, atol=1e-5, equal_nan=True)
+
 def test_z_score():
     z_help = bo_full.get_zscore_data()
     z = np.vstack(
@@ -147,6 +147,48 @@ def test_log_rbf():
     assert isinstance(weights, np.ndarray)
     assert np.allclose(np.diag(weights), 0)
 
+def test_log_rbf_cutoff():
+    weights = _log_rbf(locs, locs[:10], width=20)
+    sparse_weights = _log_rbf(locs, locs[:10], width=20, cutoff=2)
+    assert sparse_weights.shape == weights.shape
+    dense = sparse_weights.toarray()
+    near = cdist(locs, locs[:10]) <= 40
+    assert np.allclose(dense[near], weights[near])
+    assert np.all(dense[~near] == 0)
+    assert sparse_weights.nnz == np.sum(near)
+
+def test_blur_corrmat_sparse():
+    Z = _r2z(np.corrcoef(np.random.randn(5, 20)))
+    K, W = _blur_corrmat(Z, _log_rbf(locs, locs[:5], width=20))
+    K_s, W_s = _blur_corrmat(Z, _log_rbf(locs, locs[:5], width=20, cutoff=1000))
+    assert np.allclose(W, W_s)
+    assert np.allclose(np.exp(K.real), np.exp(K_s.real))
+    assert np.allclose(np.exp(K.imag), np.exp(K_s.imag))
+
+    sparse_weights = _log_rbf(locs, locs[:5], width=20, cutoff=0.5)
+    K_s, W_s = _blur_corrmat(Z, sparse_weights)
+    far = np.where(np.diff(sparse_weights.indptr) == 0)[0]
+    assert len(far) > 0
+    assert np.all(np.isinf(W_s[far, :][:, far][np.triu_indices(len(far), k=1)]))
+
+def test_blur_corrmat():
+    from scipy.special import logsumexp
+    Z = _r2z(np.corrcoef(np.random.randn(5, 20)))
+    weights = _log_rbf(locs, locs[:5], width=20)
+    K, W = _blur_corrmat(Z, weights, block_size=4)
+    triu_inds = np.triu_indices(5, k=1)
+    for x, y in [(5, 9), (0, 11), (3, 7)]:
+        next_weights = np.add.outer(weights[x], weights[y])[triu_inds]
+        with np.errstate(divide='ignore'):
+            logZ_pos = np.log(np.where(Z[triu_inds] > 0, Z[triu_inds], 0))
+            logZ_neg = np.log(np.where(Z[triu_inds] < 0, -Z[triu_inds], 0))
+        assert np.isclose(W[x, y], logsumexp(next_weights))
+        assert np.isclose(K[x, y].real, logsumexp(logZ_pos + next_weights))
+        assert np.isclose(K[x, y].imag, logsumexp(logZ_neg + next_weights))
+    assert np.all(K == K.T)
+    assert np.all(W == W.T)
+    assert np.isclose(_to_exp_real(K[0, 1]), Z[0, 1])
+
 def test_tal2mni():
     tal_vals = tal2mni(locs)
     assert isinstance(tal_vals, np.ndarray)
@@ -177,6 +219,14 @@ def test_normalize_Y():
     assert normed_y.iloc[1][0] == 1.0
     assert normed_y.iloc[1][1] == 2.0
 
+def test_simplify_log_planes():
+    X = np.random.randn(10, 10)
+    C = _to_log_complex(X)
+    C.real = np.logaddexp(C.real, np.log(np.abs(X) + 1))
+    P = _simplify_log_planes(_to_log_planes(C, dtype=np.float64), block_size=7)
+    assert np.allclose(_to_exp_real(_from_log_planes(P)), _to_exp_real(C))
+    assert np.all(np.isinf(P[0]) | np.isinf(P[1]))
+
 def test_model_compile(tmpdir):
     p = tmpdir.mkdir("sub")
     for m in range(len(data)):
@@ -189,6 +239,51 @@ def test_model_compile(tmpdir):
     assert np.allclose(mo.numerator.imag, test_model.numerator.imag, equal_nan=True)
     assert np.allclose(mo.denominator, test_model.denominator, equal_nan=True)
 
+def test_model_compile_checkpoint(tmpdir):
+    p = tmpdir.mkdir("sub")
+    for m in range(len(data)):
+        model = se.Model(data=data[m], locs=locs)
+        model.save(fname=os.path.join(p.strpath, str(m)))
+    checkpoint = os.path.join(tmpdir.strpath, 'checkpoint.mo')
+    model_data = sorted(glob.glob(os.path.join(p.strpath, '*.mo')))
+    model_compile(model_data[:2], checkpoint=checkpoint, checkpoint_every=1)
+    assert len(se.load(checkpoint).meta['compiled_files']) == 2
+    mo = model_compile(p.strpath, checkpoint=checkpoint)
+    assert mo.n_subs == len(data)
+    assert 'compiled_files' not in mo.meta
+    assert np.allclose(mo.get_model(), test_model.get_model())
+
+def test_model_compile_checkpoint_in_data_dir(tmpdir):
+    p = tmpdir.mkdir("sub")
+    for m in range(len(data)):
+        model = se.Model(data=data[m], locs=locs)
+        model.save(fname=os.path.join(p.strpath, str(m)))
+    checkpoint = os.path.join(p.strpath, 'checkpoint.mo')
+    model_data = sorted(glob.glob(os.path.join(p.strpath, '*.mo')))
+    model_compile(model_data[:2], checkpoint=checkpoint, checkpoint_every=1)
+    mo = model_compile(p.strpath, checkpoint=checkpoint)
+    assert mo.n_subs == len(data)
+    assert np.allclose(mo.get_model(), test_model.get_model())
+    assert model_compile(model_data[0]).n_subs == 1
+
+def test_model_compile_models():
+    models = [se.Model(data=d, locs=locs) for d in data]
+    numerator = np.copy(models[0].numerator)
+    mo = model_compile(models)
+    assert mo.n_subs == len(data)
+    assert models[0].n_subs == 1
+    assert np.allclose(models[0].numerator, numerator, equal_nan=True)
+    assert np.allclose(mo.get_model(), test_model.get_model())
+
+def test_solve_projection():
+    X = np.random.randn(20, 5)
+    K = np.corrcoef(X.T)
+    Kaa, Kba = K[:3, :3], K[3:, :3]
+    assert np.allclose(_solve_projection(Kaa, Kba, solver='cholesky'), _solve_projection(Kaa, Kba))
+    #rank-deficient (not positive definite) matrices fall back on an eigendecomposition
+    Kaa, Kba = np.ones([3, 3]), np.ones([2, 3])
+    assert np.allclose(_solve_projection(Kaa, Kba, solver='cholesky'), _solve_projection(Kaa, Kba))
+
 def test_timeseries_recon():
     recon = _timeseries_recon(bo, test_model, 2)
     assert isinstance(recon, np.ndarray)
@@ -208,10 +303,25 @@ def test_near_neighbor_none():
     new_bo = _near_neighbor(bo, test_model, match_threshold=0)
     assert isinstance(new_bo, se.Brain)
 
+def test_near_neighbor_filter_cache():
+    bo.get_locs()
+    new_bo = _near_neighbor(bo, test_model, match_threshold=None)
+    new_bo.get_locs()
+    assert bo._filtered['locs'][0] is bo.locs
+    assert new_bo._filtered['locs'][0] is new_bo.locs
+
 def test_near_neighbor_int():
     new_bo = _near_neighbor(bo, test_model, match_threshold=10)
     assert isinstance(new_bo, se.Brain)
 
+def test_near_neighbor_optimal():
+    greedy_bo = _near_neighbor(bo, test_model, match_threshold=None)
+    new_bo = _near_neighbor(bo, test_model, match_threshold=None, assignment='optimal')
+    assert isinstance(new_bo, se.Brain)
+    assert np.all(_count_overlapping(test_model.get_locs(), new_bo.get_locs()))
+    dist = lambda b: np.sum(np.sqrt(np.sum((b.get_locs().as_matrix() - bo.get_locs().as_matrix()) ** 2, axis=1)))
+    assert dist(new_bo) <= dist(greedy_bo) + 1e-6
+
 def test_vox_size():
     v_size = _vox_size(test_model.locs)
     assert isinstance(v_size, np.ndarray)
@@ -221,6 +331,13 @@ def test_count_overlapping():
     assert sum(bool_overlap)==bo.get_locs().shape[0]
     assert isinstance(bool_overlap, np.ndarray)
 
+def test_match_locs():
+    X = np.array([[1., 2., 3.], [0., -0., 1.], [1., 2., 3.], [5.0004, 5., 5.]])
+    Y = np.array([[1., 2., 3.], [9., 9., 9.], [0., 0., 1.], [5., 5., 5.]])
+    assert np.all(_match_locs(X, Y) == [0, -1, 1, -1])
+    assert np.all(_match_locs(X, Y, decimals=3) == [0, -1, 1, 3])
+    assert np.all(_match_locs(X[:0], Y) == -1)
+
 def test_resample():
     samp_data, samp_sess, samp_rate = _resample(bo, 8)
     assert isinstance(samp_data, pd.DataFrame)
@@ -6,6 +6,7 @@ import supereeg as se
 import numpy as np
 import scipy
 import pytest
+from supereeg.helpers import _unique, _log_rbf, _blur_corrmat, _count_overlapping
 
 # some example locations
 
@@ -53,12 +54,203 @@ def test_create_model_superuser():
     model = se.Model(numerator=numerator, denominator=denominator, locs=locs, n_subs=2)
     assert isinstance(model, se.Model)
 
+def test_create_model_factorized():
+    model = se.Model(data=data[0:3], locs=locs, rbf_width=20, n_subs=3, factorize=True)
+    assert len(model._factors) == 3
+    assert np.allclose(model.numerator.real, test_model.numerator.real, equal_nan=True)
+    assert np.allclose(model.numerator.imag, test_model.numerator.imag, equal_nan=True)
+    assert np.allclose(model.denominator, test_model.denominator, equal_nan=True)
+
+def test_model_factorized_update_and_slice():
+    model = se.Model(data=data[1:3], locs=locs, factorize=True)
+    model.update(data[0])
+    assert len(model._factors) == 3
+    assert np.allclose(model.get_model(), test_model.get_model())
+    s = model.get_slice([0, 1])
+    assert s._factors is not None
+    assert np.allclose(s.get_model(), test_model.get_slice([0, 1]).get_model())
+
+def test_model_factorized_matches_dense():
+    dense = se.Model(data=data[0:3], locs=locs[:7])
+    factorized = se.Model(data=data[0:3], locs=locs[:7], factorize=True)
+    assert np.allclose(factorized.get_model(), dense.get_model())
+    bo_d = dense.predict(data[3], nearest_neighbor=False)
+    bo_f = factorized.predict(data[3], nearest_neighbor=False)
+    assert np.allclose(bo_f.get_data().as_matrix(), bo_d.get_data().as_matrix(), equal_nan=True)
+    factorized.set_locs(locs, force_include_bo_locs=True)
+    dense.set_locs(locs, force_include_bo_locs=True)
+    assert np.allclose(factorized.get_model(), dense.get_model())
+
+def test_create_model_rbf_cutoff():
+    model = se.Model(data=data[0:3], locs=locs, rbf_width=20, n_subs=3, rbf_cutoff=1000)
+    assert np.allclose(model.get_model(), test_model.get_model())
+    model = se.Model(data=data[0:3], locs=locs, rbf_width=20, n_subs=3, rbf_cutoff=1)
+    assert model.rbf_cutoff == 1
+    assert np.all(np.isfinite(model.get_model()))
+
+def test_create_model_parallel():
+    model = se.Model(data=data[0:3], locs=locs, rbf_width=20, n_subs=3, n_jobs=2)
+    assert model.n_subs == 3
+    assert np.allclose(model.numerator.real, test_model.numerator.real, equal_nan=True)
+    assert np.allclose(model.numerator.imag, test_model.numerator.imag, equal_nan=True)
+    assert np.allclose(model.denominator, test_model.denominator, equal_nan=True)
+
+def test_model_save_mmap(tmpdir):
+    p = tmpdir.mkdir("sub").join("example")
+    test_model.save(fname=p.strpath, mmap=True)
+    mo = se.load(p.strpath + '.mo')
+    assert isinstance(mo.numerator, np.memmap)
+    assert np.allclose(mo.get_model(), test_model.get_model())
+    bo = mo.predict(data[3], nearest_neighbor=False)
+    assert isinstance(bo, se.Brain)
+    assert isinstance(mo.numerator, np.memmap)
+
+def test_model_get_rows():
+    assert np.allclose(test_model.get_rows([1, 3]), test_model.get_model()[[1, 3], :])
+    assert np.allclose(test_model.get_rows([1, 3], z_transform=True), test_model.get_model(z_transform=True)[[1, 3], :])
+
+def test_create_model_packed():
+    model = se.Model(data=data[0:3], locs=locs, rbf_width=20, n_subs=3, packed=True)
+    assert model._numerator.ndim == 1
+    assert np.allclose(model.get_model(), test_model.get_model())
+    assert np.allclose(model.get_rows([2, 5]), test_model.get_model()[[2, 5], :])
+    s = model.get_slice([5, 1, 3])
+    assert s.packed
+    assert np.allclose(s.get_model(), test_model.get_slice([5, 1, 3]).get_model())
+    model.set_locs(locs[[1, 3, 5]])
+    assert model._numerator.ndim == 1
+    assert np.allclose(model.get_model(), test_model.get_slice([1, 3, 5]).get_model())
+
+def test_create_model_log_planes():
+    model = se.Model(data=data[0:2], locs=locs, rbf_width=20, dtype=np.float32)
+    model.update(data[2])
+    assert model._numerator.shape == (2, locs.shape[0], locs.shape[0])
+    assert model._numerator.dtype == np.float32
+    assert np.allclose(model.get_model(), test_model.get_model(), atol=1e-4)
+
+def test_model_set_locs_expand():
+    model = se.Model(data=data[0:3], locs=locs[:8])
+    new_locs = np.vstack([locs[:8], locs[8:] + 1.])
+    expanded = se.Model(model)
+    expanded.set_locs(new_locs[8:], force_include_bo_locs=True)
+    full, tmp = _unique(np.vstack([model.get_locs().as_matrix(), new_locs[8:]]))
+    num, den = _blur_corrmat(model.get_model(z_transform=True), _log_rbf(full, model.get_locs()))
+    assert np.allclose(expanded.get_locs().as_matrix(), full)
+    assert np.allclose(expanded.numerator.real, num.real, equal_nan=True)
+    assert np.allclose(expanded.numerator.imag, num.imag, equal_nan=True)
+    assert np.allclose(expanded.denominator, den, equal_nan=True)
+
+def test_model_location_index():
+    model = se.Model(data=data[0:2], locs=locs)
+    index = model._location_index(decimals=3)
+    assert model._location_index(decimals=3) is index
+    assert np.all(index.find(locs[[3, 0]] + 1e-4) == [3, 0])
+    assert index.complement([0, 2, 5]) == [1, 3, 4, 6, 7, 8, 9, 10, 11]
+    model.set_locs(locs[:4])
+    assert model._location_index(decimals=3).n == 4
+
 def test_model_predict():
     model = se.Model(data=data[0:2], locs=locs)
     bo = model.predict(data[0], nearest_neighbor=False)
     print(data[0].dur)
     assert isinstance(bo, se.Brain)
 
+def test_model_predict_view():
+    model = se.Model(data=data[0:3], locs=locs[:7])
+    m = model.get_model()
+    expanded = se.Model(model)
+    expanded.set_locs(data[3].get_locs(), force_include_bo_locs=True)
+    bo = model.predict(data[3], nearest_neighbor=False)
+    assert model.get_locs().shape[0] == 7
+    assert np.allclose(model.get_model(), m)
+    assert np.allclose(bo.get_locs().as_matrix(), expanded.get_locs().as_matrix())
+    assert np.allclose(bo.get_data().as_matrix(), expanded.predict(data[3], nearest_neighbor=False).get_data().as_matrix())
+
+def test_model_view_cutoff():
+    model = se.Model(data=data[0:3], locs=locs[:7], rbf_cutoff=2)
+    expanded = se.Model(model)
+    expanded.set_locs(data[3].get_locs(), force_include_bo_locs=True)
+    view = model._get_view(data[3].get_locs())
+    assert np.allclose(view.get_locs().as_matrix(), expanded.get_locs().as_matrix())
+    assert np.allclose(view.get_model(), expanded.get_model())
+    assert np.allclose(view.get_rows([0, 8]), expanded.get_rows([0, 8]))
+
+def test_model_predict_cached_projection():
+    model = se.Model(data=data[0:2], locs=locs, projection_cache_size=1)
+    bo1 = model.predict(data[3], nearest_neighbor=False)
+    assert len(model._projections) == 1
+    bo2 = model.predict(data[3], nearest_neighbor=False)
+    assert np.allclose(bo1.data, bo2.data)
+    model.update(data[2])
+    assert len(model._projections) == 0
+    assert np.allclose(model.predict(data[3], nearest_neighbor=False).data,
+                       test_model.predict(data[3], nearest_neighbor=False).data)
+
+def test_model_predict_cached_view():
+    model = se.Model(data=data[0:2], locs=locs[:7])
+    view = model._get_view(data[3].get_locs())
+    model.predict(data[3], nearest_neighbor=False)
+    model.predict(data[3], nearest_neighbor=False)
+    assert list(model._views.values()) == [view]
+    assert len(view._projections) == 1
+    model.update(data[2])
+    assert len(model._views) == 0
+
+def test_model_view_exact_locs():
+    model = se.Model(data=data[0:2], locs=locs[:7])
+    view = model._get_view(locs[7:9])
+    assert model._get_view(locs[7:9]) is view
+    nearby = model._get_view(locs[7:9] + 1e-4)
+    assert nearby is not view
+    assert np.allclose(nearby.get_locs().as_matrix()[-2:], locs[7:9] + 1e-4, atol=0)
+
+def test_model_predict_cholesky():
+    bo_pinv = test_model.predict(data[3], nearest_neighbor=False)
+    bo_chol = test_model.predict(data[3], nearest_neighbor=False, solver='cholesky')
+    assert np.allclose(bo_pinv.data, bo_chol.data, atol=1e-6)
+    bo_ridge = test_model.predict(data[3], nearest_neighbor=False, solver='cholesky', ridge=.1)
+    assert bo_ridge.data.shape == bo_pinv.data.shape
+
+def test_model_predict_stream():
+    bo = se.Brain(data=data[3].get_data().as_matrix(), locs=data[3].get_locs(),
+                  sessions=np.array([1] * 5 + [2] * 5), sample_rate=[10, 10])
+    full = test_model.predict(bo, nearest_neighbor=False)
+    chunks = list(test_model.predict_stream(bo, chunk_size=3, nearest_neighbor=False))
+    assert all(isinstance(c, se.Brain) for c in chunks)
+    assert len(chunks) == 4
+    assert np.allclose(np.vstack([c.get_data().as_matrix() for c in chunks]), full.get_data().as_matrix())
+
+def test_model_predict_target_locs():
+    full = test_model.predict(data[3], nearest_neighbor=False)
+    targets = locs[[7, 2, 0, 11]]
+    bo = test_model.predict(data[3], nearest_neighbor=False, target_locs=targets)
+    assert np.allclose(bo.get_locs().as_matrix(), targets)
+    full_inds = [np.where(np.all(full.get_locs().as_matrix() == t, axis=1))[0][0] for t in targets]
+    assert np.allclose(bo.get_data().as_matrix(), full.get_data().as_matrix()[:, full_inds])
+
+def test_model_predict_many():
+    model = se.Model(data=data[0:3], locs=locs[:7])
+    bos = [data[3], data[4], data[3]]
+    results = model.predict_many(bos, n_jobs=2)
+    assert model.get_locs().shape[0] == 7
+    for bo, bo_p in zip(bos, results):
+        expected = se.Model(model).predict(bo)
+        assert np.allclose(bo_p.get_locs().as_matrix(), expected.get_locs().as_matrix())
+        assert np.allclose(bo_p.get_data().as_matrix(), expected.get_data().as_matrix())
+
+def test_model_predict_many_views():
+    model = se.Model(data=data[0:3], locs=locs[:7])
+    bos = [data[3], se.Brain(data=data[4].get_data().as_matrix(), locs=locs[[1, 8, 9, 10, 11]]), data[3]]
+    results = model.predict_many(bos)
+    views = list(model._views.values())
+    assert len(views) == 2
+    for bo, view in zip(bos, views):
+        assert view.get_locs().shape[0] == np.sum(~_count_overlapping(locs[:7], bo.get_locs())) + 7
+    targets = locs[[8, 2]]
+    for bo, bo_p in zip(bos, model.predict_many(bos, target_locs=targets)):
+        assert np.allclose(bo_p.get_data().as_matrix(),
+                           model.predict(bo, target_locs=targets).get_data().as_matrix())
+
 def test_model_predict_nn():
     print(data[0].dur)
     model = se.Model(data=data[0:2], locs=locs)
@@ -70,6 +262,15 @@ def test_model_predict_nn_thresh():
     bo = model.predict(data[0], nearest_neighbor=True, match_threshold=30)
     assert isinstance(bo, se.Brain)
 
+def test_model_predict_nn_thresh_unfiltered():
+    model = se.Model(data=data[0:2], locs=locs)
+    bo_locs = data[0].get_locs().as_matrix().copy()
+    bo_locs[0, :] += 100 #out of the model's range, so this electrode is removed
+    bo = se.Brain(data=data[0].get_data().as_matrix(), locs=bo_locs, sample_rate=10, filter=None)
+    bo_p = model.predict(bo, nearest_neighbor=True)
+    assert isinstance(bo_p, se.Brain)
+    assert bo_p.get_locs().shape[0] == locs.shape[0]
+
 def test_model_predict_nn_0():
     model = se.Model(data=data[0:2], locs=locs)
     bo_1 = model.predict(data[0], nearest_neighbor=True, match_threshold=0)